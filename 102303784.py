@@ -7,10 +7,16 @@ Roll Number: 102203579
 
 import sys
 import os
+import time
 import shutil
 import re
 from yt_dlp import YoutubeDL
 from pydub import AudioSegment
+from downloader import build_ydl_opts, search_videos, search_count, filter_entries, download_first, HEAD_ONLY_DOWNLOADS
+from audio_cache import get_source_cache, get_trim_cache, get_search_cache
+from audio_merge import stream_merge, pcm_merge, ffmpeg_mashup, MERGE_ENGINE, PIPELINE_BACKEND
+from trimming import TrimStage, TRIM_ENGINE, OVERLAP_STAGES, available_cpus
+from profiling import start_profiler
 
 
 def validate_inputs(singer_name, num_videos, duration, output_file):
@@ -40,6 +46,27 @@ def validate_inputs(singer_name, num_videos, duration, output_file):
     return errors
 
 
+def split_options(args):
+    """Separate the optional --jobs N (or --jobs=N, -j N) and --profile from the positional arguments"""
+    positional = []
+    jobs = None
+    profile = False
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg.startswith('--jobs='):
+            jobs = arg.split('=', 1)[1]
+        elif arg in ('--jobs', '-j') and index + 1 < len(args):
+            index += 1
+            jobs = args[index]
+        elif arg == '--profile':
+            profile = True
+        else:
+            positional.append(arg)
+        index += 1
+    return positional, jobs, profile
+
+
 def create_directories():
     """Create necessary directories for downloads"""
     directories = ['downloads', 'audios', 'trimmed']
@@ -50,51 +77,50 @@ def create_directories():
     print("✓ Created directories: downloads/, audios/, trimmed/")
 
 
-def download_videos(singer_name, num_videos):
-    """Download YouTube videos of the singer"""
+def download_videos(singer_name, num_videos, duration=None, max_workers=None, ydl_class=YoutubeDL,
+                    extract_audio=True, on_download=None):
+    """
+    Download YouTube videos of the singer (only the first `duration` seconds in head-only mode).
+
+    on_download(file_path) is called as soon as each download lands.
+    """
     print(f"\n🎵 Searching for '{singer_name}' videos on YouTube...")
     
-    downloaded_files = []
-    
     # yt-dlp options with anti-bot measures
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'outtmpl': 'downloads/%(title)s.%(ext)s',
-        'quiet': False,
-        'no_warnings': False,
-        'extract_flat': False,
-        'ignoreerrors': True,
-        # Anti-bot detection measures
-        'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
-        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    }
+    head_seconds = duration if HEAD_ONLY_DOWNLOADS else None
+    ydl_opts = build_ydl_opts('downloads', quiet=False, head_seconds=head_seconds,
+                              extract_audio=extract_audio)
+    if head_seconds:
+        print(f"  Head-only mode: fetching the first {head_seconds}s of each video")
+    ydl_opts['extract_flat'] = False
     
-    # Use cookies if available
-    if os.path.exists('youtube_cookies.txt'):
-        ydl_opts['cookiefile'] = 'youtube_cookies.txt'
+    if 'cookiefile' in ydl_opts:
         print("  Using cookies file for authentication")
     
-    search_query = f"ytsearch{num_videos}:{singer_name}"
-    
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            print(f"Downloading {num_videos} videos...")
-            info = ydl.extract_info(search_query, download=True)
-            
-            if 'entries' in info:
-                for idx, entry in enumerate(info['entries'], 1):
-                    if entry:
-                        print(f"  [{idx}/{num_videos}] Downloaded: {entry.get('title', 'Unknown')}")
-            
-        # Get downloaded mp3 files
-        for file in os.listdir('downloads'):
-            if file.endswith('.mp3'):
-                downloaded_files.append(os.path.join('downloads', file))
+        # Over-fetch candidates, then drop live streams, shorts, compilations etc.
+        candidates = search_videos(singer_name, search_count(num_videos), ydl_opts,
+                                   ydl_class=ydl_class, cache=get_search_cache())
+        entries, rejected = filter_entries(candidates, duration)
+        for entry, reason in rejected:
+            print(f"  Skipped: {entry['title']} ({reason})")
+        print(f"Downloading {min(num_videos, len(entries))} of {len(entries)} candidate videos...")
+        
+        downloaded = []
+        
+        def report(index, entry, file_path, error):
+            if error:
+                print(f"  ⚠ Failed: {entry['title']} ({str(error)})")
+            else:
+                downloaded.append(file_path)
+                print(f"  [{len(downloaded)}/{num_videos}] Downloaded: {entry['title']}")
+                if on_download:
+                    on_download(file_path)
+        
+        downloaded_files = download_first(entries, num_videos, ydl_opts, on_result=report,
+                                          max_workers=max_workers, ydl_class=ydl_class,
+                                          cache=get_source_cache(), head_seconds=head_seconds,
+                                          clip_seconds=duration)
         
         print(f"✓ Successfully downloaded {len(downloaded_files)} audio files")
         return downloaded_files
@@ -124,57 +150,84 @@ def convert_to_audio(downloaded_files):
     return audio_files
 
 
-def trim_audio(audio_files, duration):
-    """Trim first Y seconds from each audio file"""
-    print(f"\n✂️  Trimming first {duration} seconds from each audio...")
+def trim_audio(audio_files, duration, engine=None, workers=None):
+    """
+    Trim first Y seconds from each audio file (engine: 'pydub' or 'frames').
+
+    Files are trimmed on `workers` processes (--jobs, TRIM_WORKERS by default),
+    the result keeps the order of audio_files and files that fail are skipped.
+    """
+    engine = engine or TRIM_ENGINE
+    print(f"\n✂️  Trimming first {duration} seconds from each audio ({engine} engine)...")
     
-    trimmed_files = []
-    duration_ms = duration * 1000  # Convert to milliseconds
+    cache = get_trim_cache()
+    done = []
     
-    for idx, audio_path in enumerate(audio_files, 1):
-        try:
-            # Load audio file
-            audio = AudioSegment.from_mp3(audio_path)
-            
-            # Trim first Y seconds
-            trimmed_audio = audio[:duration_ms]
-            
-            # Save trimmed audio
-            filename = os.path.basename(audio_path)
-            trimmed_path = os.path.join('trimmed', f"trimmed_{filename}")
-            trimmed_audio.export(trimmed_path, format='mp3')
-            
-            trimmed_files.append(trimmed_path)
-            print(f"  [{idx}/{len(audio_files)}] Trimmed: {filename}")
-        
-        except Exception as e:
-            print(f"  ⚠ Warning: Could not trim {audio_path}: {str(e)}")
+    def report(audio_path, trimmed_path, reused, error):
+        done.append(audio_path)
+        filename = os.path.basename(audio_path)
+        if error:
+            print(f"  ⚠ Warning: Could not trim {audio_path}: {str(error)}")
+        elif reused:
+            print(f"  [{len(done)}/{len(audio_files)}] Reused cached clip: {filename}")
+        else:
+            print(f"  [{len(done)}/{len(audio_files)}] Trimmed: {filename}")
+    
+    # Reuses clips trimmed by an earlier run (same video, duration, settings)
+    stage = TrimStage(duration, engine, 'trimmed', cache=cache, workers=workers, on_trim=report)
+    try:
+        for audio_path in audio_files:
+            stage.submit(audio_path)
+    finally:
+        stage.finish()
+    trimmed_files = stage.results(audio_files)
     
     print(f"✓ Trimmed {len(trimmed_files)} audio files")
+    if stage.reused:
+        stats = cache.stats()
+        print(f"  ♻️  Reused {stage.reused} cached clips "
+              f"(trim cache has saved {stats['saved_seconds']:.1f}s of encoding so far)")
     return trimmed_files
 
 
-def merge_audios(trimmed_files, output_file):
-    """Merge all trimmed audios into one file"""
+def merge_audios(trimmed_files, output_file, engine=None, clip_seconds=None):
+    """Merge all trimmed audios into one file (engine: 'stream', 'numpy' or 'pydub')"""
     print(f"\n🔗 Merging {len(trimmed_files)} audio files...")
+    engine = engine or MERGE_ENGINE
     
     try:
-        # Start with empty audio
-        combined = AudioSegment.empty()
+        def report(idx, trimmed_path):
+            print(f"  [{idx + 1}/{len(trimmed_files)}] Merged: {os.path.basename(trimmed_path)}")
         
-        for idx, trimmed_path in enumerate(trimmed_files, 1):
-            audio = AudioSegment.from_mp3(trimmed_path)
-            combined += audio
-            print(f"  [{idx}/{len(trimmed_files)}] Merged: {os.path.basename(trimmed_path)}")
+        if engine == 'stream':
+            # Stream every clip through one encoder, memory stays flat
+            duration = stream_merge(trimmed_files, output_file,
+                                    ffmpeg=AudioSegment.converter, on_clip=report)
+        elif engine == 'numpy':
+            # Decode every clip into one preallocated buffer, encode it once
+            if not clip_seconds:
+                raise Exception("The numpy merge engine needs the clip duration")
+            duration = pcm_merge(trimmed_files, output_file, clip_seconds,
+                                 ffmpeg=AudioSegment.converter, on_clip=report)
+        else:
+            # Start with empty audio
+            combined = AudioSegment.empty()
+            
+            for idx, trimmed_path in enumerate(trimmed_files, 1):
+                audio = AudioSegment.from_mp3(trimmed_path)
+                combined += audio
+                print(f"  [{idx}/{len(trimmed_files)}] Merged: {os.path.basename(trimmed_path)}")
+            
+            # Export final file
+            combined.export(output_file, format='mp3')
+            duration = len(combined) / 1000
         
-        # Export final file
-        combined.export(output_file, format='mp3')
         print(f"✓ Successfully created: {output_file}")
         
         # Get file size
         file_size = os.path.getsize(output_file) / (1024 * 1024)  # MB
         print(f"  File size: {file_size:.2f} MB")
-        print(f"  Duration: {len(combined) / 1000:.2f} seconds")
+        print(f"  Duration: {duration:.2f} seconds")
         
         return True
     
@@ -200,10 +253,11 @@ def main():
     print("=" * 60)
     
     # Check command line arguments
-    if len(sys.argv) != 5:
+    args, jobs, profile = split_options(sys.argv[1:])
+    if len(args) != 4:
         print("\n❌ Error: Incorrect number of parameters")
         print("\nUsage:")
-        print('  python 102203579.py "<SingerName>" <NumberOfVideos> <AudioDuration> <OutputFileName>')
+        print('  python 102203579.py "<SingerName>" <NumberOfVideos> <AudioDuration> <OutputFileName> [--jobs N] [--profile]')
         print("\nExample:")
         print('  python 102203579.py "Sharry Maan" 20 20 output.mp3')
         print("\nParameters:")
@@ -211,13 +265,12 @@ def main():
         print("  NumberOfVideos  : Number of videos to download (must be > 10)")
         print("  AudioDuration   : Duration to trim from each audio in seconds (must be > 20)")
         print("  OutputFileName  : Name of output mp3 file")
+        print("  --jobs N        : Files trimmed in parallel (default: number of CPUs)")
+        print("  --profile       : Save a cProfile/tracemalloc/ffmpeg timing bundle of this run")
         sys.exit(1)
     
     # Parse arguments
-    singer_name = sys.argv[1]
-    num_videos = sys.argv[2]
-    duration = sys.argv[3]
-    output_file = sys.argv[4]
+    singer_name, num_videos, duration, output_file = args
     
     print(f"\n📋 Input Parameters:")
     print(f"  Singer Name    : {singer_name}")
@@ -227,6 +280,16 @@ def main():
     
     # Validate inputs
     errors = validate_inputs(singer_name, num_videos, duration, output_file)
+    if jobs is not None:
+        try:
+            jobs = int(jobs)
+            if jobs < 1:
+                errors.append(f"--jobs must be at least 1 (got {jobs})")
+        except ValueError:
+            errors.append("--jobs must be an integer")
+    if jobs is None and not os.environ.get('TRIM_WORKERS'):
+        # The CLI is the only job on the machine, unlike a job worker
+        jobs = available_cpus()
     if errors:
         print("\n❌ Validation Errors:")
         for error in errors:
@@ -236,29 +299,71 @@ def main():
     num_videos = int(num_videos)
     duration = int(duration)
     
+    # --profile always profiles, otherwise PROFILE_SAMPLE_RATE decides
+    profiler = start_profiler(f"cli-{time.strftime('%Y%m%d-%H%M%S')}", 1 if profile else None)
+    stage = profiler.set_stage if profiler else (lambda name: None)
+    if profiler:
+        # Subprocesses are only timed in this process, so trim here instead of on a process pool
+        jobs = 1
+    
     try:
         # Create directories
         create_directories()
         
         # Download videos
-        downloaded_files = download_videos(singer_name, num_videos)
+        stage('download')
+        single_pass = PIPELINE_BACKEND == 'ffmpeg'
+        trim_stage = None
+        if OVERLAP_STAGES and not single_pass:
+            # Trim each file as soon as it lands, while the other downloads continue
+            def report_trim(audio_path, trimmed_path, reused, error):
+                if error:
+                    print(f"  ⚠ Warning: Could not trim {audio_path}: {str(error)}")
+                else:
+                    print(f"  {'Reused cached clip' if reused else 'Trimmed'}: {os.path.basename(audio_path)}")
+            
+            trim_stage = TrimStage(duration, TRIM_ENGINE, 'trimmed', cache=get_trim_cache(),
+                                   workers=jobs, on_trim=report_trim)
+        try:
+            downloaded_files = download_videos(singer_name, num_videos, duration,
+                                               extract_audio=not single_pass,
+                                               on_download=trim_stage.submit if trim_stage else None)
+        finally:
+            if trim_stage:
+                trim_stage.finish()
         
         if len(downloaded_files) == 0:
             print("\n❌ Error: No videos were downloaded")
             sys.exit(1)
         
-        # Convert to audio (already done, just organize files)
-        audio_files = convert_to_audio(downloaded_files)
-        
-        # Trim audio files
-        trimmed_files = trim_audio(audio_files, duration)
-        
-        if len(trimmed_files) == 0:
-            print("\n❌ Error: No audio files were trimmed")
-            sys.exit(1)
-        
-        # Merge audio files
-        merge_audios(trimmed_files, output_file)
+        if single_pass:
+            # Trim + merge + encode in one ffmpeg run, straight from the downloads
+            print(f"\n🎛️  Building mashup from the first {duration} seconds in one ffmpeg pass...")
+            stage('merge')
+            trimmed_files = ffmpeg_mashup(downloaded_files, duration, output_file,
+                                          ffmpeg=AudioSegment.converter)
+            print(f"✓ Successfully created: {output_file}")
+        else:
+            if trim_stage:
+                # Already trimmed while downloading, straight from the downloads
+                stage('trim')
+                trimmed_files = trim_stage.results(downloaded_files)
+                print(f"✓ Trimmed {len(trimmed_files)} audio files while downloading")
+            else:
+                # Convert to audio (already done, just organize files)
+                audio_files = convert_to_audio(downloaded_files)
+                
+                # Trim audio files
+                stage('trim')
+                trimmed_files = trim_audio(audio_files, duration, workers=jobs)
+            
+            if len(trimmed_files) == 0:
+                print("\n❌ Error: No audio files were trimmed")
+                sys.exit(1)
+            
+            # Merge audio files
+            stage('merge')
+            merge_audios(trimmed_files, output_file, clip_seconds=duration)
         
         # Cleanup
         cleanup_temp_directories()
@@ -271,6 +376,11 @@ def main():
         print(f"  Total videos downloaded : {len(downloaded_files)}")
         print(f"  Total audios trimmed    : {len(trimmed_files)}")
         print(f"  Final output file       : {os.path.abspath(output_file)}")
+        cache = get_source_cache()
+        if cache:
+            stats = cache.stats()
+            print(f"  Audio cache             : {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['evictions']} evictions")
         print("=" * 60)
     
     except KeyboardInterrupt:
@@ -282,6 +392,10 @@ def main():
         print(f"\n❌ Fatal Error: {str(e)}")
         cleanup_temp_directories()
         sys.exit(1)
+    
+    finally:
+        if profiler:
+            profiler.stop()
 
 
 if __name__ == "__main__":
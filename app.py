@@ -5,275 +5,29 @@ Author: Student
 Roll Number: 102303784
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, send_file
 import os
-import shutil
 import re
-import zipfile
-import smtplib
 import subprocess
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
-from yt_dlp import YoutubeDL
-import threading
+import sys
+from audio_cache import get_source_cache, get_trim_cache, get_search_cache
+from job_queue import get_job_queue, QueueFullError
+from result_store import get_result_store
+from metrics import get_metrics
+from mailer import get_outbox, check_config, SMTP_SERVER, SMTP_PORT, SMTP_EMAIL, SMTP_PASSWORD
+from audio_merge import probe_ffmpeg
 
-# Configure FFmpeg paths BEFORE importing pydub
-# Try Windows path first (local development)
-FFMPEG_PATH = r"C:\Users\ASUS\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.0.1-full_build\bin"
-
-# If not found, FFmpeg should be in system PATH (production/Linux)
-if os.path.exists(FFMPEG_PATH):
-    os.environ['PATH'] = FFMPEG_PATH + os.pathsep + os.environ.get('PATH', '')
-
-# NOW import pydub after setting PATH
-from pydub import AudioSegment
+# The pipeline (yt-dlp, pydub, ffmpeg) is only imported by the job workers (pipeline.py),
+# so a web worker boots without loading it
 
 app = Flask(__name__)
 
-# FFmpeg location (already set in PATH above)
-FFMPEG_LOCATION = FFMPEG_PATH if os.path.exists(FFMPEG_PATH) else None
-
-# Configure pydub to use FFmpeg explicitly
-if FFMPEG_LOCATION:
-    AudioSegment.converter = os.path.join(FFMPEG_LOCATION, 'ffmpeg.exe')
-    AudioSegment.ffmpeg = os.path.join(FFMPEG_LOCATION, 'ffmpeg.exe')
-    AudioSegment.ffprobe = os.path.join(FFMPEG_LOCATION, 'ffprobe.exe')
-    # Also set as environment variable
-    os.environ['FFMPEG_BINARY'] = os.path.join(FFMPEG_LOCATION, 'ffmpeg.exe')
-    os.environ['FFPROBE_BINARY'] = os.path.join(FFMPEG_LOCATION, 'ffprobe.exe')
-
-# Email configuration (use environment variables for security)
-SMTP_SERVER = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
-SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
-SMTP_EMAIL = os.environ.get('SMTP_EMAIL', '')
-SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
-
-
 def validate_email(email):
     """Validate email format"""
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
 
-def create_directories():
-    """Create necessary directories"""
-    directories = ['downloads', 'audios', 'trimmed', 'output']
-    for directory in directories:
-        if os.path.exists(directory):
-            shutil.rmtree(directory)
-        os.makedirs(directory)
-
-
-def download_videos(singer_name, num_videos):
-    """Download YouTube videos"""
-    downloaded_files = []
-    
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'outtmpl': 'downloads/%(title)s.%(ext)s',
-        'quiet': True,
-        'no_warnings': True,
-        'ignoreerrors': True,
-        # Anti-bot detection measures
-        'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
-        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    }
-    
-    # Add FFmpeg location if found
-    if FFMPEG_LOCATION:
-        ydl_opts['ffmpeg_location'] = FFMPEG_LOCATION
-    
-    # Use cookies if available
-    if os.path.exists('youtube_cookies.txt'):
-        ydl_opts['cookiefile'] = 'youtube_cookies.txt'
-    
-    search_query = f"ytsearch{num_videos}:{singer_name}"
-    
-    with YoutubeDL(ydl_opts) as ydl:
-        ydl.extract_info(search_query, download=True)
-    
-    for file in os.listdir('downloads'):
-        if file.endswith('.mp3'):
-            downloaded_files.append(os.path.join('downloads', file))
-    
-    return downloaded_files
-
-
-def process_audio(downloaded_files):
-    """Copy audio files to audios folder"""
-    audio_files = []
-    for file_path in downloaded_files:
-        filename = os.path.basename(file_path)
-        audio_path = os.path.join('audios', filename)
-        shutil.copy(file_path, audio_path)
-        audio_files.append(audio_path)
-    return audio_files
-
-
-def trim_audio(audio_files, duration):
-    """Trim first Y seconds from each audio"""
-    trimmed_files = []
-    duration_ms = duration * 1000
-    
-    # Set ffmpeg/ffprobe paths for this process
-    if FFMPEG_LOCATION:
-        AudioSegment.converter = os.path.join(FFMPEG_LOCATION, 'ffmpeg.exe')
-        AudioSegment.ffmpeg = os.path.join(FFMPEG_LOCATION, 'ffmpeg.exe')
-        AudioSegment.ffprobe = os.path.join(FFMPEG_LOCATION, 'ffprobe.exe')
-    
-    for audio_path in audio_files:
-        try:
-            print(f"  Trimming: {os.path.basename(audio_path)}")
-            audio = AudioSegment.from_mp3(audio_path)
-            trimmed_audio = audio[:duration_ms]
-            
-            filename = os.path.basename(audio_path)
-            trimmed_path = os.path.join('trimmed', f"trimmed_{filename}")
-            trimmed_audio.export(trimmed_path, format='mp3')
-            trimmed_files.append(trimmed_path)
-            print(f"    ✓ Trimmed successfully")
-        except Exception as e:
-            print(f"    ✗ Error: {str(e)}")
-    
-    return trimmed_files
-
-
-def merge_audios(trimmed_files, output_file):
-    """Merge all audio files"""
-    # Set ffmpeg/ffprobe paths for this process
-    if FFMPEG_LOCATION:
-        AudioSegment.converter = os.path.join(FFMPEG_LOCATION, 'ffmpeg.exe')
-        AudioSegment.ffmpeg = os.path.join(FFMPEG_LOCATION, 'ffmpeg.exe')
-        AudioSegment.ffprobe = os.path.join(FFMPEG_LOCATION, 'ffprobe.exe')
-    
-    combined = AudioSegment.empty()
-    
-    for trimmed_path in trimmed_files:
-        audio = AudioSegment.from_mp3(trimmed_path)
-        combined += audio
-    
-    combined.export(output_file, format='mp3')
-
-
-def create_zip(mp3_file, zip_file):
-    """Create zip file containing the mp3"""
-    with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        zipf.write(mp3_file, os.path.basename(mp3_file))
-
-
-def send_email(to_email, zip_file):
-    """Send email with zip attachment"""
-    if not SMTP_EMAIL or not SMTP_PASSWORD:
-        raise Exception("Email configuration not set. Please set SMTP_EMAIL and SMTP_PASSWORD environment variables.")
-    
-    # Create message
-    msg = MIMEMultipart()
-    msg['From'] = SMTP_EMAIL
-    msg['To'] = to_email
-    msg['Subject'] = "Mashup Result"
-    
-    body = """Hello!
-
-Your mashup has been generated successfully. Please find the attached zip file containing your audio mashup.
-
-Thank you for using our Mashup service!
-
-Best regards,
-Mashup Team
-"""
-    
-    msg.attach(MIMEText(body, 'plain'))
-    
-    # Attach zip file
-    with open(zip_file, 'rb') as attachment:
-        part = MIMEBase('application', 'zip')
-        part.set_payload(attachment.read())
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', f'attachment; filename={os.path.basename(zip_file)}')
-        msg.attach(part)
-    
-    # Send email
-    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-    server.starttls()
-    server.login(SMTP_EMAIL, SMTP_PASSWORD)
-    server.send_message(msg)
-    server.quit()
-
-
-def cleanup_directories():
-    """Clean up temporary directories"""
-    directories = ['downloads', 'audios', 'trimmed', 'output']
-    for directory in directories:
-        if os.path.exists(directory):
-            shutil.rmtree(directory)
-
-
-def process_mashup(singer_name, num_videos, duration, email):
-    """Process mashup in background"""
-    try:
-        print(f"🎵 Starting mashup for {singer_name}...")
-        
-        # Create directories
-        create_directories()
-        print("✓ Created directories")
-        
-        # Download videos
-        print(f"⬇️  Downloading {num_videos} videos...")
-        downloaded_files = download_videos(singer_name, num_videos)
-        print(f"✓ Downloaded {len(downloaded_files)} videos")
-        
-        if len(downloaded_files) == 0:
-            raise Exception("No videos were downloaded")
-        
-        # Process audio
-        print("🎧 Processing audio files...")
-        audio_files = process_audio(downloaded_files)
-        print(f"✓ Processed {len(audio_files)} audio files")
-        
-        # Trim audio
-        print(f"✂️  Trimming first {duration} seconds...")
-        trimmed_files = trim_audio(audio_files, duration)
-        print(f"✓ Trimmed {len(trimmed_files)} audio files")
-        
-        if len(trimmed_files) == 0:
-            raise Exception("No audio files were trimmed")
-        
-        # Merge audios
-        print("🔗 Merging audio files...")
-        output_mp3 = 'output/mashup.mp3'
-        merge_audios(trimmed_files, output_mp3)
-        print("✓ Merged audio files")
-        
-        # Create zip
-        print("📦 Creating zip file...")
-        output_zip = 'output/mashup.zip'
-        create_zip(output_mp3, output_zip)
-        print("✓ Created zip file")
-        
-        # Send email
-        print(f"📧 Sending email to {email}...")
-        send_email(email, output_zip)
-        print("✓ Email sent successfully")
-        
-        # Cleanup
-        print("🧹 Cleaning up...")
-        cleanup_directories()
-        print("✓ Cleanup completed")
-        
-        print("✅ Mashup process completed successfully!")
-        
-    except Exception as e:
-        print(f"❌ Error in mashup process: {str(e)}")
-        cleanup_directories()
-
-
 @app.route('/')
 def index():
     """Home page"""
@@ -313,18 +67,23 @@ def process():
         if not validate_email(email):
             errors.append("Invalid email format")
         
-        if not SMTP_EMAIL or not SMTP_PASSWORD:
+        try:
+            check_config()
+        except Exception:
             errors.append("Email service not configured. Please set SMTP_EMAIL and SMTP_PASSWORD environment variables.")
         
         if errors:
             return jsonify({'success': False, 'errors': errors}), 400
         
-        # Start processing in background thread
-        thread = threading.Thread(target=process_mashup, args=(singer_name, num_videos, duration, email))
-        thread.daemon = True
-        thread.start()
+        # Queue the job, the worker pool (worker.py) picks it up
+        # An identical job already in progress is shared instead of starting a new one
+        try:
+            job_id, coalesced = get_job_queue().enqueue(singer_name, num_videos, duration, email)
+        except QueueFullError as e:
+            return jsonify({'success': False, 'errors': [str(e)]}), 503
         
-        return jsonify({'success': True, 'message': 'Mashup is being processed. You will receive an email shortly.'})
+        return jsonify({'success': True, 'job_id': job_id, 'coalesced': coalesced,
+                        'message': 'Mashup is being processed. You will receive an email shortly.'})
     
     except Exception as e:
         return jsonify({'success': False, 'errors': [str(e)]}), 500
@@ -336,6 +95,86 @@ def result():
     return render_template('result.html')
 
 
+@app.route('/download/<job_id>')
+def download(job_id):
+    """Serve a stored mashup for a signed link (supports Range and If-None-Match)"""
+    try:
+        path = get_result_store().open_link(job_id, request.args.get('expires'), request.args.get('sig'))
+    except PermissionError as e:
+        return jsonify({'success': False, 'errors': [str(e)]}), 403
+    except FileNotFoundError as e:
+        return jsonify({'success': False, 'errors': [str(e)]}), 410
+    
+    # conditional=True answers Range and If-None-Match requests, the file itself
+    # goes through the server's file wrapper (sendfile under gunicorn)
+    return send_file(path, mimetype='audio/mpeg', as_attachment=True, download_name='mashup.mp3',
+                     conditional=True, etag=True, max_age=3600)
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics: stage latencies and job outcomes (from every process), queue and caches"""
+    counts = get_job_queue().counts()
+    email = get_outbox().stats()
+    gauges = [
+        ('mashup_jobs', 'Jobs in the queue, by status',
+         [({'status': status}, count) for status, count in counts.items()]),
+        ('mashup_active_jobs', 'Jobs being processed right now', [({}, counts.get('running', 0))]),
+        ('mashup_queue_depth', 'Jobs waiting for a worker', [({}, counts.get('queued', 0))]),
+        ('mashup_email_queue_depth', 'Emails waiting to be sent', [({}, email['queue_depth'])]),
+    ]
+    
+    caches = (('search_results', get_search_cache()), ('source_audio', get_source_cache()),
+              ('trimmed_clips', get_trim_cache()))
+    hits, misses, ratios = [], [], []
+    for name, cache in caches:
+        if cache is None:
+            continue
+        stats = cache.stats()
+        hits.append(({'cache': name}, stats['hits']))
+        misses.append(({'cache': name}, stats['misses']))
+        lookups = stats['hits'] + stats['misses']
+        ratios.append(({'cache': name}, stats['hits'] / lookups if lookups else 0))
+    gauges += [
+        ('mashup_cache_hits', 'Cache hits since the cache was created', hits),
+        ('mashup_cache_misses', 'Cache misses since the cache was created', misses),
+        ('mashup_cache_hit_ratio', 'Cache hits / lookups', ratios),
+    ]
+    
+    return Response(get_metrics().render(gauges), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/jobs/stats')
+def job_stats():
+    """Jobs per status, coalesced requests and email queue depth/latency"""
+    stats = get_job_queue().stats()
+    stats['email'] = get_outbox().stats()
+    return jsonify(stats)
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Current status, stage, per-stage elapsed time and ETA of a job"""
+    status = get_job_queue().status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'errors': ['Unknown job']}), 404
+    status['deliveries'] = get_outbox().job_deliveries(job_id)
+    return jsonify(status)
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Hit/miss/eviction counters of the shared caches"""
+    source_cache = get_source_cache()
+    trim_cache = get_trim_cache()
+    search_cache = get_search_cache()
+    return jsonify({
+        'search_results': search_cache.stats() if search_cache else None,
+        'source_audio': source_cache.stats() if source_cache else None,
+        'trimmed_clips': trim_cache.stats() if trim_cache else None,
+    })
+
+
 if __name__ == '__main__':
     print("=" * 60)
     print("🎵 MASHUP WEB SERVICE")
@@ -354,11 +193,18 @@ if __name__ == '__main__':
         print("    SMTP_PORT=587 (optional)")
     
     print("\n🎬 FFmpeg Configuration:")
-    if FFMPEG_LOCATION:
-        print(f"  ✓ FFmpeg found: {FFMPEG_LOCATION}")
+    # Probed once here, the job workers started below inherit the result
+    ffmpeg = probe_ffmpeg()
+    if ffmpeg['version']:
+        print(f"  ✓ FFmpeg found: {ffmpeg['ffmpeg']} ({ffmpeg['version']})")
     else:
         print("  ⚠️  FFmpeg not detected in PATH")
     
+    # Job workers run in their own processes (only once under the reloader)
+    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        print("\n🛠️  Starting job workers...")
+        subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')])
+    
     print("\n🌐 Starting Flask server...")
     print("=" * 60)
     
@@ -0,0 +1,316 @@
+"""
+Mashup Assignment - Shared Caches
+On-disk caches for search results, downloaded audio and trimmed clips,
+shared by all jobs and workers
+"""
+
+import os
+import re
+import time
+import shutil
+import sqlite3
+import json
+import hashlib
+import threading
+
+
+# Where downloaded source audio is kept between jobs ('' disables the cache)
+AUDIO_CACHE_DIR = os.environ.get('AUDIO_CACHE_DIR', os.path.join('cache', 'audio'))
+
+# Disk budget for the source audio cache
+AUDIO_CACHE_MAX_MB = int(os.environ.get('AUDIO_CACHE_MAX_MB', '1024'))
+
+# Second-level cache of finished trimmed clips ('' disables it)
+TRIM_CACHE_DIR = os.environ.get('TRIM_CACHE_DIR', os.path.join('cache', 'trimmed'))
+TRIM_CACHE_MAX_MB = int(os.environ.get('TRIM_CACHE_MAX_MB', '256'))
+
+# Trimmed clips not used for this long are dropped even when under budget
+TRIM_CACHE_MAX_AGE_HOURS = float(os.environ.get('TRIM_CACHE_MAX_AGE_HOURS', '24'))
+
+# Encoding settings each trim engine produces (part of the trimmed clip key)
+TRIM_CODEC_SETTINGS = {
+    'pydub': 'mp3-ffmpeg-default',
+    'frames': 'mp3-frame-copy',
+}
+
+# Search results are reused for this many seconds ('0' disables the cache)
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', '3600'))
+SEARCH_CACHE_PATH = os.environ.get('SEARCH_CACHE_PATH', os.path.join('cache', 'search.sqlite3'))
+
+VIDEO_ID_PATTERN = re.compile(r'\[([A-Za-z0-9_-]+)\]\.\w+$')
+
+
+def _link_or_copy(src, dst):
+    """Hard link src to dst (no data copied), fall back to a copy across devices"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class DiskCache:
+    """
+    Content-addressed file cache with a byte budget and LRU eviction.
+
+    Files live under root/objects, the index (sizes, last use, counters) is a
+    SQLite database in WAL mode so several processes can share one cache.
+    Files are written to a temp name and renamed into place, so readers never
+    see a partial file. An entry can record `coverage` (seconds of audio it
+    holds) so a short head-only download is not served for a longer request,
+    and `cost` (seconds it took to produce) which is added up on every hit.
+    With max_age, entries unused for that many seconds are evicted as well.
+    """
+
+    def __init__(self, root, max_bytes, max_age=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.objects = os.path.join(root, 'objects')
+        os.makedirs(self.objects, exist_ok=True)
+        self.db_path = os.path.join(root, 'index.sqlite3')
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, path TEXT, filename TEXT,
+                size INTEGER, coverage REAL, last_used REAL, cost REAL)''')
+            db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            columns = [row[1] for row in db.execute('PRAGMA table_info(entries)')]
+            if 'cost' not in columns:
+                db.execute('ALTER TABLE entries ADD COLUMN cost REAL')
+
+    def _connect(self):
+        """One connection per thread (sqlite connections are not shared)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            self._local.db = db
+        return db
+
+    def _count(self, db, name, amount=1):
+        db.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                   'ON CONFLICT(name) DO UPDATE SET value = value + ?', (name, amount, amount))
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash the key parts (e.g. video id + format) into a file-safe key"""
+        return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+    def get(self, key, dest_dir, min_coverage=None, dest_name=None):
+        """
+        Place the cached file for key into dest_dir and return its path.
+
+        The file keeps the name it was stored with unless dest_name is given.
+        Returns None on a miss (or when the entry covers less than
+        min_coverage seconds).
+        """
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT path, filename, coverage, cost FROM entries WHERE key = ?',
+                             (key,)).fetchone()
+            usable = row is not None and (
+                min_coverage is None or row[2] is None or row[2] >= min_coverage)
+            if usable:
+                db.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+                if row[3]:
+                    self._count(db, 'saved_ms', int(row[3] * 1000))
+            self._count(db, 'hits' if usable else 'misses')
+        if not usable:
+            return None
+
+        dest_path = os.path.join(dest_dir, dest_name or row[1])
+        try:
+            _link_or_copy(row[0], dest_path)
+        except FileNotFoundError:
+            # Evicted by another worker between the lookup and the link
+            with db:
+                db.execute('DELETE FROM entries WHERE key = ? AND path = ?', (key, row[0]))
+            return None
+        return dest_path
+
+    def put(self, key, file_path, coverage=None, cost=None):
+        """Store a copy of file_path under key and evict old entries if over budget"""
+        shard = os.path.join(self.objects, key[:2])
+        os.makedirs(shard, exist_ok=True)
+        extension = os.path.splitext(file_path)[1]
+        object_path = os.path.join(shard, key + extension)
+        temp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        _link_or_copy(file_path, temp_path)
+        os.replace(temp_path, object_path)
+        size = os.path.getsize(object_path)
+
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            old = db.execute('SELECT path FROM entries WHERE key = ?', (key,)).fetchone()
+            db.execute('INSERT OR REPLACE INTO entries '
+                       '(key, path, filename, size, coverage, last_used, cost) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (key, object_path, os.path.basename(file_path), size, coverage,
+                        time.time(), cost))
+        if old and old[0] != object_path:
+            self._remove(old[0])
+        self.evict()
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until the cache fits its budget"""
+        removed = []
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            if self.max_age:
+                cutoff = time.time() - self.max_age
+                expired = db.execute('SELECT path FROM entries WHERE last_used < ?',
+                                     (cutoff,)).fetchall()
+                db.execute('DELETE FROM entries WHERE last_used < ?', (cutoff,))
+                removed.extend(path for (path,) in expired)
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self.max_bytes:
+                for key, path, size in db.execute(
+                        'SELECT key, path, size FROM entries ORDER BY last_used').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                    removed.append(path)
+                    total -= size
+            if removed:
+                self._count(db, 'evictions', len(removed))
+        for path in removed:
+            self._remove(path)
+        return len(removed)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        """Hit/miss/eviction counters plus current size, shared by all processes"""
+        db = self._connect()
+        counters = dict(db.execute('SELECT name, value FROM counters').fetchall())
+        entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+            'saved_seconds': counters.get('saved_ms', 0) / 1000,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+_source_cache = None
+
+
+def get_source_cache():
+    """The shared cache of downloaded source audio (None when disabled)"""
+    global _source_cache
+    if _source_cache is None and AUDIO_CACHE_DIR:
+        _source_cache = DiskCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_MB * 1024 * 1024)
+    return _source_cache
+
+
+_trim_cache = None
+
+
+def get_trim_cache():
+    """The shared cache of trimmed clips (None when disabled)"""
+    global _trim_cache
+    if _trim_cache is None and TRIM_CACHE_DIR:
+        _trim_cache = DiskCache(TRIM_CACHE_DIR, TRIM_CACHE_MAX_MB * 1024 * 1024,
+                                max_age=TRIM_CACHE_MAX_AGE_HOURS * 3600)
+    return _trim_cache
+
+
+def trim_cache_key(audio_path, duration, engine):
+    """
+    Key of a trimmed clip: video id + clip duration + encoding settings.
+
+    The video id comes from the '[id]' part of the download filename,
+    files without one are not cached (returns None).
+    """
+    match = VIDEO_ID_PATTERN.search(os.path.basename(audio_path))
+    if not match:
+        return None
+    return DiskCache.make_key(match.group(1), duration, TRIM_CODEC_SETTINGS.get(engine, engine))
+
+
+class SearchCache:
+    """
+    TTL cache of resolved ytsearch entry lists, stored in SQLite.
+
+    Keyed by the normalized singer name. A result fetched for N videos also
+    answers any later request for fewer videos until it expires.
+    """
+
+    def __init__(self, db_path, ttl):
+        self.db_path = db_path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS searches (
+                query TEXT PRIMARY KEY, count INTEGER, entries TEXT, created REAL)''')
+            db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def normalize(singer_name):
+        """Case and whitespace insensitive form of the singer name"""
+        return ' '.join(singer_name.lower().split())
+
+    def get(self, singer_name, num_videos):
+        """Return the first num_videos cached entries, or None if not cached / expired"""
+        db = self._connect()
+        with db:
+            row = db.execute('SELECT count, entries FROM searches WHERE query = ? AND created > ?',
+                             (self.normalize(singer_name), time.time() - self.ttl)).fetchone()
+            hit = row is not None and row[0] >= num_videos
+            db.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                       'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+                       ('hits' if hit else 'misses',))
+        if not hit:
+            return None
+        return json.loads(row[1])[:num_videos]
+
+    def put(self, singer_name, num_videos, entries):
+        """Store a search result unless a fresh, larger one is already cached"""
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            query = self.normalize(singer_name)
+            row = db.execute('SELECT count FROM searches WHERE query = ? AND created > ?',
+                             (query, time.time() - self.ttl)).fetchone()
+            if row is None or row[0] <= num_videos:
+                db.execute('INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)',
+                           (query, num_videos, json.dumps(entries), time.time()))
+            db.execute('DELETE FROM searches WHERE created <= ?', (time.time() - self.ttl,))
+
+    def stats(self):
+        db = self._connect()
+        counters = dict(db.execute('SELECT name, value FROM counters').fetchall())
+        entries = db.execute('SELECT COUNT(*) FROM searches').fetchone()[0]
+        return {'hits': counters.get('hits', 0), 'misses': counters.get('misses', 0),
+                'entries': entries, 'ttl': self.ttl}
+
+
+_search_cache = None
+
+
+def get_search_cache():
+    """The shared search result cache (None when disabled)"""
+    global _search_cache
+    if _search_cache is None and SEARCH_CACHE_PATH and SEARCH_CACHE_TTL > 0:
+        _search_cache = SearchCache(SEARCH_CACHE_PATH, SEARCH_CACHE_TTL)
+    return _search_cache
@@ -0,0 +1,432 @@
+"""
+Mashup Assignment - Audio Merge Backends
+Merges trimmed clips without holding the whole mashup in memory
+"""
+
+import os
+import mmap
+import shutil
+import tempfile
+import traceback
+import subprocess
+
+
+# PCM format every clip is decoded to before it reaches the encoder
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+
+# Bytes copied from a decoder to the encoder at a time
+CHUNK_SIZE = 256 * 1024
+
+# Merge engine: 'stream' (one long-running encoder), 'numpy' (one preallocated PCM
+# buffer, encoded once) or 'pydub' (in-memory concat)
+MERGE_ENGINE = os.environ.get('MERGE_ENGINE', 'stream')
+
+# numpy engine only: bring every clip to this RMS level in dBFS (empty: keep levels as they are)
+MERGE_LOUDNESS = os.environ.get('MERGE_LOUDNESS', '')
+
+# numpy engine only: most a quiet clip is boosted by when normalizing
+MERGE_MAX_GAIN_DB = float(os.environ.get('MERGE_MAX_GAIN_DB', '12'))
+
+# numpy engine only: equal-power crossfade between clips in milliseconds (0: hard cuts)
+MERGE_CROSSFADE_MS = int(os.environ.get('MERGE_CROSSFADE_MS', '0'))
+
+# numpy engine: a mashup whose decoded PCM would be larger than this is assembled in a
+# memory-mapped file next to the output (the job's scratch directory) instead of RAM, 0 always does
+MERGE_RAM_BUDGET_MB = float(os.environ.get('MERGE_RAM_BUDGET_MB', '256'))
+
+# Pipeline backend: 'steps' (download mp3 -> trim -> merge) or 'ffmpeg'
+# (download raw audio, then one ffmpeg run does trim + concat + encode)
+PIPELINE_BACKEND = os.environ.get('PIPELINE_BACKEND', 'steps')
+
+# Windows FFmpeg install used for local development, production finds it in the system PATH
+FFMPEG_PATH = r"C:\Users\ASUS\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.0.1-full_build\bin"
+FFMPEG_LOCATION = FFMPEG_PATH if os.path.exists(FFMPEG_PATH) else None
+
+
+def probe_ffmpeg():
+    """
+    Paths of ffmpeg/ffprobe and the ffmpeg version line ('' if ffmpeg is missing).
+
+    The first call looks them up and runs `ffmpeg -version`, then stores the
+    result in the environment: processes forked or started afterwards (gunicorn
+    web workers, job workers, trim processes) reuse it instead of probing again.
+    """
+    if 'MASHUP_FFMPEG' not in os.environ:
+        if FFMPEG_LOCATION:
+            os.environ['PATH'] = FFMPEG_LOCATION + os.pathsep + os.environ.get('PATH', '')
+            ffmpeg = os.path.join(FFMPEG_LOCATION, 'ffmpeg.exe')
+            ffprobe = os.path.join(FFMPEG_LOCATION, 'ffprobe.exe')
+            os.environ['FFMPEG_BINARY'] = ffmpeg
+            os.environ['FFPROBE_BINARY'] = ffprobe
+        else:
+            ffmpeg = shutil.which('ffmpeg') or 'ffmpeg'
+            ffprobe = shutil.which('ffprobe') or 'ffprobe'
+        try:
+            output = subprocess.run([ffmpeg, '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    text=True, timeout=10).stdout
+            version = output.splitlines()[0] if output else ''
+        except (OSError, subprocess.SubprocessError):
+            version = ''
+        os.environ.update({'MASHUP_FFMPEG': ffmpeg, 'MASHUP_FFPROBE': ffprobe,
+                           'MASHUP_FFMPEG_VERSION': version})
+    return {
+        'ffmpeg': os.environ['MASHUP_FFMPEG'],
+        'ffprobe': os.environ['MASHUP_FFPROBE'],
+        'version': os.environ['MASHUP_FFMPEG_VERSION'],
+    }
+
+
+def _pcm_args():
+    return ['-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS)]
+
+
+def _start_decoder(ffmpeg, path, clip_seconds=None):
+    """ffmpeg decoding path to PCM on its stdout (errors go to a file, a pipe could fill up)"""
+    limit = ['-t', str(clip_seconds)] if clip_seconds else []
+    errors = tempfile.TemporaryFile()
+    decoder = subprocess.Popen(
+        [ffmpeg, '-loglevel', 'error'] + limit + ['-i', path, '-vn'] + _pcm_args() + ['pipe:1'],
+        stdout=subprocess.PIPE, stderr=errors
+    )
+    return decoder, errors
+
+
+def _finish_decoder(decoder, errors):
+    """Wait for a decoder, returns its error message ('' when it succeeded)"""
+    decoder.stdout.close()
+    returncode = decoder.wait()
+    message = ''
+    if returncode != 0:
+        errors.seek(0)
+        lines = errors.read().decode(errors='replace').strip().splitlines()
+        message = lines[-1] if lines else f"ffmpeg exited with {returncode}"
+    errors.close()
+    return message
+
+
+def stream_merge(input_files, output_file, ffmpeg='ffmpeg', on_clip=None):
+    """
+    Merge audio files by streaming decoded PCM into a single mp3 encoder.
+
+    Clips are decoded one at a time and copied to the encoder in CHUNK_SIZE
+    pieces, so peak memory does not depend on the number or length of the
+    clips. on_clip(index, path) is called after each clip is fed in.
+    A clip that fails to decode is reported and the merge goes on without
+    the rest of it (raises if no clip could be decoded). Returns the
+    duration of the mashup in seconds.
+    """
+    encoder = subprocess.Popen(
+        [ffmpeg, '-y', '-loglevel', 'error'] + _pcm_args() + ['-i', 'pipe:0', output_file],
+        stdin=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    total_bytes = 0
+    try:
+        for index, path in enumerate(input_files):
+            decoder, errors = _start_decoder(ffmpeg, path)
+            clip_bytes = 0
+            try:
+                while True:
+                    chunk = decoder.stdout.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    encoder.stdin.write(chunk)
+                    clip_bytes += len(chunk)
+            finally:
+                error = _finish_decoder(decoder, errors)
+            total_bytes += clip_bytes
+            if error:
+                # Already streamed to the encoder, whatever was decoded stays in
+                seconds = clip_bytes / (SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH)
+                kept = f"kept the first {seconds:.1f}s" if clip_bytes else "skipped"
+                print(f"  ⚠ Could not decode {os.path.basename(path)} ({kept}): {error}")
+            if on_clip:
+                on_clip(index, path)
+        if not total_bytes:
+            raise Exception("None of the clips could be decoded")
+        encoder.stdin.close()
+    except BaseException:
+        encoder.kill()
+        encoder.wait()
+        raise
+
+    error = encoder.stderr.read().decode(errors='replace')
+    encoder.stderr.close()
+    if encoder.wait() != 0:
+        raise Exception(f"ffmpeg encoder failed: {error.strip()}")
+
+    return total_bytes / (SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH)
+
+
+def _clip_energy(numpy, buffer, clips, release):
+    """Mean square of every clip (0-1 scale), in one chunked pass over the buffer"""
+    energy = numpy.zeros(len(clips))
+    chunk_frames = CHUNK_SIZE // (CHANNELS * SAMPLE_WIDTH)
+    for index, (start, end) in enumerate(clips):
+        for chunk_start in range(start, end, chunk_frames):
+            samples = buffer[chunk_start:min(chunk_start + chunk_frames, end)].astype(numpy.float32).ravel()
+            energy[index] += numpy.dot(samples, samples)
+        release()
+    frames = numpy.array([max(end - start, 1) for start, end in clips])
+    return energy / (frames * CHANNELS * 32768.0 ** 2)
+
+
+def shape_clips(buffer, clips, loudness=None, crossfade_frames=0, release=None):
+    """
+    Normalize and crossfade the clips packed in buffer, in place.
+
+    clips lists the (start, end) frames of each clip. With loudness (dBFS),
+    every clip's gain is computed from one pass over the buffer (capped at
+    +MERGE_MAX_GAIN_DB). A second pass applies the gains CHUNK_SIZE frames at
+    a time and overlaps consecutive clips by crossfade_frames with
+    equal-power (cos/sin) fades, moving each clip left over the overlap.
+    release() is called after each clip of either pass. Returns the number
+    of frames in use afterwards.
+    """
+    import numpy
+
+    release = release or (lambda: None)
+    gains = numpy.ones(len(clips))
+    if loudness is not None:
+        energy = _clip_energy(numpy, buffer, clips, release)
+        with numpy.errstate(divide='ignore'):
+            level = 10 * numpy.log10(energy)
+        gains = numpy.where(energy > 0, 10 ** (numpy.minimum(loudness - level, MERGE_MAX_GAIN_DB) / 20), 1)
+
+    chunk_frames = CHUNK_SIZE // (CHANNELS * SAMPLE_WIDTH)
+    position = 0
+    for index, (start, end) in enumerate(clips):
+        gain = numpy.float32(gains[index])
+        overlap = 0
+        if index and crossfade_frames:
+            previous = clips[index - 1][1] - clips[index - 1][0]
+            overlap = min(crossfade_frames, previous, end - start)
+        if overlap:
+            # The previous clip's tail (already gained) fades out under this clip's head
+            angle = numpy.linspace(0, numpy.pi / 2, overlap, dtype=numpy.float32)[:, None]
+            tail = buffer[position - overlap:position].astype(numpy.float32) * numpy.cos(angle)
+            tail += buffer[start:start + overlap].astype(numpy.float32) * (gain * numpy.sin(angle))
+            numpy.clip(tail, -32768, 32767, out=tail)
+            buffer[position - overlap:position] = tail
+        # Ascending chunks: each one is read before it is written, further left
+        for chunk_start in range(start + overlap, end, chunk_frames):
+            chunk_end = min(chunk_start + chunk_frames, end)
+            if gain == 1 and position == chunk_start:
+                position = chunk_end
+                continue
+            chunk = buffer[chunk_start:chunk_end].astype(numpy.float32)
+            chunk *= gain
+            numpy.clip(chunk, -32768, 32767, out=chunk)
+            buffer[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        release()
+    return position
+
+
+class PCMScratch:
+    """
+    A PCM buffer in a memory-mapped file (sparse, created at its full size).
+
+    Pages written or read through the mapping count towards the process'
+    RSS until release() drops them from the process. Their data stays in
+    the page cache, which the kernel writes out to the file under memory
+    pressure.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+    def release(self):
+        if hasattr(mmap, 'MADV_DONTNEED'):
+            self.map.madvise(mmap.MADV_DONTNEED)
+
+    def close(self, size=None):
+        """Unmap the file (no numpy views may be left) and cut it to size bytes"""
+        if not self.map.closed:
+            self.map.close()
+        if size is not None:
+            self.file.truncate(size)
+        self.file.close()
+
+    def remove(self):
+        """Delete the file, then unmap it (even while a view still exists)"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        try:
+            self.close()
+        except BufferError:
+            # A view is left somewhere: the mapping goes with it, the file is already gone
+            self.file.close()
+
+
+def _encode_pcm(ffmpeg, output_file, data=None, source=None):
+    """Encode raw PCM (data written to ffmpeg's stdin, or the file source) to output_file"""
+    encoder = subprocess.Popen(
+        [ffmpeg, '-y', '-loglevel', 'error'] + _pcm_args() + ['-i', source or 'pipe:0', output_file],
+        stdin=subprocess.PIPE if source is None else subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        if source is None:
+            encoder.stdin.write(data)
+            encoder.stdin.close()
+    except BaseException:
+        encoder.kill()
+        encoder.wait()
+        raise
+    error = encoder.stderr.read().decode(errors='replace')
+    encoder.stderr.close()
+    if encoder.wait() != 0:
+        raise Exception(f"ffmpeg encoder failed: {error.strip()}")
+
+
+def pcm_merge(input_files, output_file, clip_seconds, ffmpeg='ffmpeg', on_clip=None,
+              loudness=MERGE_LOUDNESS, crossfade_ms=MERGE_CROSSFADE_MS, ram_budget_mb=MERGE_RAM_BUDGET_MB):
+    """
+    Merge the first clip_seconds of each file through one preallocated PCM buffer.
+
+    The int16 buffer is sized for len(input_files) * clip_seconds up front.
+    Each decoder resamples to SAMPLE_RATE/CHANNELS and its output is read
+    straight into the clip's slice of the buffer (readinto, no intermediate
+    bytes), shorter clips are packed without gaps. Loudness normalization
+    and crossfades (see shape_clips) are applied to the buffer in place, then
+    the encoder is fed the filled part of the buffer in one write.
+
+    When the buffer would be larger than ram_budget_mb it is a PCMScratch
+    file next to output_file instead: pages are released after every clip
+    and the encoder reads the file itself, so peak RSS stays flat however
+    long the mashup is. on_clip(index, path) is called after each clip is
+    decoded. A clip that fails to decode is reported and left out (raises
+    if no clip could be decoded). Returns the duration in seconds.
+    """
+    import numpy
+
+    frame_bytes = CHANNELS * SAMPLE_WIDTH
+    clip_bytes = int(clip_seconds * SAMPLE_RATE) * frame_bytes
+    total_bytes = len(input_files) * clip_bytes
+    scratch = None
+    if total_bytes and total_bytes > ram_budget_mb * 1024 * 1024:
+        scratch = PCMScratch(os.path.join(os.path.dirname(os.path.abspath(output_file)),
+                                          f".{os.path.basename(output_file)}.pcm"), total_bytes)
+        buffer = numpy.frombuffer(scratch.map, dtype=numpy.int16).reshape(-1, CHANNELS)
+    else:
+        # Pages are only allocated as clips are decoded into them
+        buffer = numpy.empty((total_bytes // frame_bytes, CHANNELS), dtype=numpy.int16)
+    release = scratch.release if scratch else (lambda: None)
+    view = memoryview(buffer).cast('B')
+    try:
+        position = 0
+        clips = []
+        for index, path in enumerate(input_files):
+            start = position
+            end = position + clip_bytes
+            decoder, errors = _start_decoder(ffmpeg, path, clip_seconds)
+            try:
+                while position < end:
+                    read = decoder.stdout.readinto(view[position:end])
+                    if not read:
+                        break
+                    position += read
+            finally:
+                error = _finish_decoder(decoder, errors)
+            # A full clip is fine even if the decoder then failed on the pipe we closed
+            if error and position < end:
+                print(f"  ⚠ Skipped {os.path.basename(path)}, could not decode it: {error}")
+                position = start
+            # A clip that ended mid-frame must not shift the next one
+            position -= position % frame_bytes
+            clips.append((start // frame_bytes, position // frame_bytes))
+            release()
+            if on_clip:
+                on_clip(index, path)
+
+        clips = [(start, end) for start, end in clips if end > start]
+        if not clips:
+            raise Exception("None of the clips could be decoded")
+        if clips and (loudness not in (None, '') or crossfade_ms):
+            frames = shape_clips(buffer, clips, float(loudness) if loudness not in (None, '') else None,
+                                 int(crossfade_ms * SAMPLE_RATE / 1000), release)
+            position = frames * frame_bytes
+
+        if scratch:
+            # The mapping can only be closed once nothing points into it
+            view.release()
+            del buffer
+            scratch.close(position)
+            _encode_pcm(ffmpeg, output_file, source=scratch.path)
+        else:
+            _encode_pcm(ffmpeg, output_file, data=view[:position])
+    except BaseException as e:
+        if scratch:
+            # The traceback's frames (shape_clips, ...) hold views of the mapping
+            traceback.clear_frames(e.__traceback__)
+        raise
+    finally:
+        if scratch:
+            view.release()
+            buffer = None
+            scratch.remove()
+
+    return position / (SAMPLE_RATE * frame_bytes)
+
+
+def _unreadable_sources(source_files, ffmpeg):
+    """Return the sources ffmpeg cannot decode (checks the first second only)"""
+    bad = []
+    for path in source_files:
+        result = subprocess.run(
+            [ffmpeg, '-v', 'error', '-t', '1', '-i', path, '-vn', '-f', 'null', '-'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        if result.returncode != 0:
+            bad.append(path)
+    return bad
+
+
+def build_mashup_command(source_files, duration, output_file, ffmpeg='ffmpeg'):
+    """Build one ffmpeg command that trims, concatenates and encodes all sources"""
+    command = [ffmpeg, '-y', '-loglevel', 'error']
+    for path in source_files:
+        # -t before -i stops reading each source after `duration` seconds
+        command += ['-t', str(duration), '-i', path]
+
+    audio_format = f"aformat=sample_fmts=fltp:sample_rates={SAMPLE_RATE}:channel_layouts=stereo"
+    filters = [f"[{index}:a:0]{audio_format}[a{index}]" for index in range(len(source_files))]
+    inputs = ''.join(f"[a{index}]" for index in range(len(source_files)))
+    filters.append(f"{inputs}concat=n={len(source_files)}:v=0:a=1[out]")
+
+    command += ['-filter_complex', ';'.join(filters), '-map', '[out]', '-vn', output_file]
+    return command
+
+
+def ffmpeg_mashup(source_files, duration, output_file, ffmpeg='ffmpeg'):
+    """
+    Build the whole mashup with a single ffmpeg run (trim + concat + encode).
+
+    Sources can be any format ffmpeg reads, so the downloads do not need to be
+    converted to mp3 first. If the run fails, sources that cannot be decoded
+    are dropped and it is retried once. Returns the sources that were used.
+    """
+    if not source_files:
+        raise Exception("No audio sources to merge")
+
+    result = subprocess.run(build_mashup_command(source_files, duration, output_file, ffmpeg),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode == 0:
+        return list(source_files)
+
+    bad = _unreadable_sources(source_files, ffmpeg)
+    usable = [path for path in source_files if path not in bad]
+    if not bad or not usable:
+        raise Exception(f"ffmpeg mashup failed: {result.stderr.decode(errors='replace').strip()}")
+
+    for path in bad:
+        print(f"  ⚠ Skipping unreadable audio: {os.path.basename(path)}")
+    result = subprocess.run(build_mashup_command(usable, duration, output_file, ffmpeg),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg mashup failed: {result.stderr.decode(errors='replace').strip()}")
+    return usable
@@ -0,0 +1,940 @@
+"""
+Benchmark Script for Mashup Assignment
+Runs the pipeline offline against locally generated audio fixtures
+"""
+
+import io
+import os
+import sys
+import json
+import argparse
+import platform
+import time
+import shutil
+import socket
+import tempfile
+import resource
+import contextlib
+import subprocess
+import threading
+import statistics
+import multiprocessing
+import urllib.request
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+
+FIXTURE_DIR = os.path.join(tempfile.gettempdir(), 'mashup_fixtures')
+
+
+def generate_fixtures(count, seconds, fixture_dir=FIXTURE_DIR):
+    """Generate sine-tone mp3 files with ffmpeg (reused between runs)"""
+    os.makedirs(fixture_dir, exist_ok=True)
+    fixtures = []
+    for index in range(count):
+        path = os.path.join(fixture_dir, f"tone_{index:03d}_{seconds}s.mp3")
+        if not os.path.exists(path):
+            frequency = 220 + 20 * index
+            subprocess.run(
+                ['ffmpeg', '-y', '-loglevel', 'error',
+                 '-f', 'lavfi', '-i', f"sine=frequency={frequency}:duration={seconds}",
+                 '-ac', '2', '-ar', '44100', '-b:a', '192k', path],
+                check=True
+            )
+        fixtures.append(path)
+    return fixtures
+
+
+class FakeYoutubeDL:
+    """
+    Stand-in for yt_dlp.YoutubeDL that serves local fixture files.
+
+    Search queries return one entry per fixture, downloads sleep for
+    `latency` seconds and copy the fixture into the outtmpl location.
+    Search and download calls are counted.
+    """
+
+    fixtures = []
+    latency = 0.0
+    search_latency = 0.0
+    search_calls = 0
+    download_calls = 0
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def _entry(self, index):
+        return {
+            'id': f"fake{index:04d}",
+            'url': f"fake://{index}",
+            'title': f"Fake Video {index}",
+            'duration': 180,
+            'ext': 'mp3',
+        }
+
+    def prepare_filename(self, info):
+        outtmpl = self.params.get('outtmpl', '%(title)s.%(ext)s')
+        return outtmpl % info
+
+    def extract_info(self, url, download=True):
+        if url.startswith('ytsearch'):
+            FakeYoutubeDL.search_calls += 1
+            time.sleep(self.search_latency)
+            count = int(url[len('ytsearch'):url.index(':')])
+            count = min(count, len(self.fixtures))
+            return {'entries': [self._entry(index) for index in range(count)]}
+
+        index = int(url[len('fake://'):])
+        info = self._entry(index)
+        if download:
+            FakeYoutubeDL.download_calls += 1
+            time.sleep(self.latency)
+            file_path = self.prepare_filename(info)
+            os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+            shutil.copy(self.fixtures[index], file_path)
+            info['requested_downloads'] = [{'filepath': file_path}]
+        return info
+
+
+def bench_download_pool(num_videos=12, latency=0.5, worker_counts=(1, 2, 4, 8)):
+    """Time download_entries with the fake extractor at several pool sizes"""
+    from downloader import build_ydl_opts, search_videos, download_entries
+
+    FakeYoutubeDL.fixtures = generate_fixtures(num_videos, 30)
+    FakeYoutubeDL.latency = latency
+
+    print(f"\n⬇️  Download pool: {num_videos} videos, {latency}s simulated latency each")
+    results = {}
+    for workers in worker_counts:
+        output_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+        try:
+            ydl_opts = build_ydl_opts(output_dir)
+            entries = search_videos('fake singer', num_videos, ydl_opts, ydl_class=FakeYoutubeDL)
+            start = time.perf_counter()
+            files = download_entries(entries, ydl_opts, max_workers=workers, ydl_class=FakeYoutubeDL)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        results[workers] = elapsed
+        print(f"  workers={workers:<2} files={len(files):<3} wall={elapsed:.2f}s")
+    return results
+
+
+class CountingHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler that counts the bytes it sends.
+
+    Sending is throttled to `rate` bytes/second so the socket buffers do not
+    swallow the whole file before the client stops reading.
+    """
+
+    bytes_sent = 0
+    rate = 4 * 1024 * 1024
+    lock = threading.Lock()
+
+    def copyfile(self, source, outputfile):
+        chunk_size = 16 * 1024
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            try:
+                outputfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                break
+            with CountingHandler.lock:
+                CountingHandler.bytes_sent += len(chunk)
+            time.sleep(len(chunk) / self.rate)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory):
+    """Serve a directory over HTTP on a random local port"""
+    handler = partial(CountingHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_head_only(duration=25, video_seconds=360):
+    """Compare bytes fetched for a full download and a head-only download"""
+    from downloader import build_ydl_opts, download_entry
+
+    fixture = generate_fixtures(1, video_seconds)[0]
+    server = serve_directory(os.path.dirname(fixture))
+    url = f"http://127.0.0.1:{server.server_port}/{os.path.basename(fixture)}"
+    entry = {'id': 'local', 'url': url, 'title': 'local fixture'}
+
+    print(f"\n✂️  Head-only download: first {duration}s of a {video_seconds}s file")
+    results = {}
+    for label, head_seconds in (('full', None), ('head-only', duration)):
+        output_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+        CountingHandler.bytes_sent = 0
+        try:
+            ydl_opts = build_ydl_opts(output_dir, head_seconds=head_seconds)
+            ydl_opts['noprogress'] = True
+            start = time.perf_counter()
+            download_entry(entry, ydl_opts)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        results[label] = {'bytes': CountingHandler.bytes_sent, 'wall': elapsed}
+        print(f"  {label:<9} fetched={CountingHandler.bytes_sent / 1024:.0f} KB wall={elapsed:.2f}s")
+
+    server.shutdown()
+    return results
+
+
+def bench_trim_engines(num_files=8, duration=25, video_seconds=180):
+    """Compare the pydub trim (decode + re-encode) with MP3 frame slicing"""
+    from pydub import AudioSegment
+    from mp3_slicer import slice_mp3
+
+    def pydub_trim(audio_path, trimmed_path):
+        audio = AudioSegment.from_mp3(audio_path)
+        audio[:duration * 1000].export(trimmed_path, format='mp3')
+
+    def frames_trim(audio_path, trimmed_path):
+        slice_mp3(audio_path, trimmed_path, duration)
+
+    fixtures = generate_fixtures(num_files, video_seconds)
+
+    print(f"\n✂️  Trim engines: {num_files} files, first {duration}s of {video_seconds}s")
+    results = {}
+    for engine, trim in (('pydub', pydub_trim), ('frames', frames_trim)):
+        output_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+        try:
+            start = time.perf_counter()
+            for audio_path in fixtures:
+                trim(audio_path, os.path.join(output_dir, os.path.basename(audio_path)))
+            elapsed = time.perf_counter() - start
+            lengths = [len(AudioSegment.from_mp3(os.path.join(output_dir, name))) / 1000
+                       for name in os.listdir(output_dir)]
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        results[engine] = {'wall': elapsed, 'min_length': min(lengths), 'max_length': max(lengths)}
+        print(f"  {engine:<6} wall={elapsed:.2f}s clip length={min(lengths):.2f}-{max(lengths):.2f}s")
+    return results
+
+
+def bench_trim_scaling(num_files=16, duration=25, video_seconds=60, worker_counts=(1, 2, 4, 8)):
+    """Trim the same files on 1..N processes (pydub engine) and check the output order"""
+    from trimming import TrimStage
+
+    fixtures = generate_fixtures(num_files, video_seconds)
+
+    print(f"\n🧮 Trim scaling: {num_files} files, first {duration}s, {os.cpu_count()} CPUs")
+    results = {}
+    expected = [f"trimmed_{os.path.basename(path)}" for path in fixtures]
+    for workers in worker_counts:
+        output_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+        try:
+            start = time.perf_counter()
+            stage = TrimStage(duration, 'pydub', output_dir, workers=workers)
+            for path in fixtures:
+                stage.submit(path)
+            trimmed = stage.results(fixtures)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        ordered = [os.path.basename(path) for path in trimmed] == expected
+        results[workers] = {'wall': elapsed, 'ordered': ordered}
+        speedup = results[worker_counts[0]]['wall'] / elapsed
+        print(f"  workers={workers:<2} wall={elapsed:.2f}s speedup={speedup:.1f}x ordered={ordered}")
+    return results
+
+
+def bench_stage_overlap(num_videos=12, latency=2.0, duration=25, video_seconds=60, workers=4):
+    """Download everything then trim (barrier) vs trim each file as its download lands"""
+    from downloader import build_ydl_opts, search_videos, download_first
+    from trimming import TrimStage
+
+    FakeYoutubeDL.fixtures = generate_fixtures(num_videos, video_seconds)
+    FakeYoutubeDL.latency = latency
+
+    print(f"\n🚰 Stage overlap: {num_videos} videos, {latency}s simulated latency, "
+          f"{workers} download + {workers} trim workers")
+    results = {}
+    for mode in ('barrier', 'overlap'):
+        output_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+        try:
+            trimmed_dir = os.path.join(output_dir, 'trimmed')
+            os.makedirs(trimmed_dir)
+            ydl_opts = build_ydl_opts(os.path.join(output_dir, 'downloads'))
+            entries = search_videos('fake singer', num_videos, ydl_opts, ydl_class=FakeYoutubeDL)
+
+            start = time.perf_counter()
+            stage = TrimStage(duration, 'pydub', trimmed_dir, workers=workers)
+
+            def landed(index, entry, file_path, error):
+                if file_path and mode == 'overlap':
+                    stage.submit(file_path)
+
+            files = download_first(entries, num_videos, ydl_opts, on_result=landed,
+                                   max_workers=workers, ydl_class=FakeYoutubeDL)
+            downloaded = time.perf_counter() - start
+            if mode == 'barrier':
+                for file_path in files:
+                    stage.submit(file_path)
+            trimmed = stage.results(files)
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        results[mode] = {'wall': elapsed, 'download': downloaded, 'trimmed': len(trimmed)}
+        print(f"  {mode:<8} downloads done={downloaded:.2f}s end-to-end={elapsed:.2f}s "
+              f"clips={len(trimmed)}")
+    FakeYoutubeDL.latency = 0.0
+    trim_only = results['barrier']['wall'] - results['barrier']['download']
+    print(f"  download={results['barrier']['download']:.2f}s + trim={trim_only:.2f}s "
+          f"-> overlap {results['overlap']['wall']:.2f}s")
+    return results
+
+
+def _merge_in_child(engine, input_files, output_file, duration):
+    """Run one merge engine and return this process' peak RSS in MB"""
+    from pydub import AudioSegment
+    from audio_merge import stream_merge, pcm_merge
+
+    start = time.perf_counter()
+    if engine == 'stream':
+        stream_merge(input_files, output_file)
+    elif engine == 'numpy':
+        pcm_merge(input_files, output_file, duration, loudness='', crossfade_ms=0)
+    elif engine == 'numpy+shape':
+        # Loudness normalization and 500 ms crossfades on top of the plain numpy merge
+        pcm_merge(input_files, output_file, duration, loudness=-18, crossfade_ms=500)
+    else:
+        combined = AudioSegment.empty()
+        for path in input_files:
+            combined += AudioSegment.from_mp3(path)
+        combined.export(output_file, format='mp3')
+    elapsed = time.perf_counter() - start
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, elapsed
+
+
+def bench_merge_memory(clip_counts=(10, 40), duration=30):
+    """Peak RSS and time of the pydub, streaming and numpy merges (each run in a fresh process)"""
+    fixtures = generate_fixtures(max(clip_counts), duration)
+    context = multiprocessing.get_context('spawn')
+
+    print(f"\n🔗 Merge memory: clips of {duration}s")
+    results = {}
+    for engine in ('pydub', 'stream', 'numpy', 'numpy+shape'):
+        for count in clip_counts:
+            output_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+            try:
+                output_file = os.path.join(output_dir, 'mashup.mp3')
+                with context.Pool(1) as pool:
+                    peak_mb, elapsed = pool.apply(_merge_in_child, (engine, fixtures[:count], output_file, duration))
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            results[f"{engine}-{count}"] = {'peak_rss_mb': peak_mb, 'wall': elapsed}
+            print(f"  {engine:<11} clips={count:<3} peak RSS={peak_mb:.0f} MB wall={elapsed:.2f}s")
+    return results
+
+
+def _scratch_merge_in_child(input_files, output_file, duration, ram_budget_mb):
+    """pcm_merge with normalization and crossfades, returns (peak RSS MB, wall, mashup seconds)"""
+    from audio_merge import pcm_merge
+
+    start = time.perf_counter()
+    seconds = pcm_merge(input_files, output_file, duration, loudness=-18, crossfade_ms=500,
+                        ram_budget_mb=ram_budget_mb)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, time.perf_counter() - start, seconds
+
+
+def bench_low_memory(clip_counts=(10, 40, 80), duration=30, rss_ceiling_mb=100):
+    """
+    Peak RSS of the numpy merge in RAM and in a memory-mapped scratch file as
+    the mashup grows. Fails (ok=False) when a scratch run exceeds rss_ceiling_mb.
+    """
+    fixtures = generate_fixtures(max(clip_counts), duration)
+    context = multiprocessing.get_context('spawn')
+
+    print(f"\n💾 Low-memory merge: clips of {duration}s, scratch mode RSS ceiling {rss_ceiling_mb} MB")
+    results = {'ok': True}
+    for mode, budget in (('ram', float('inf')), ('scratch', 0)):
+        for count in clip_counts:
+            output_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+            try:
+                output_file = os.path.join(output_dir, 'mashup.mp3')
+                with context.Pool(1) as pool:
+                    peak_mb, elapsed, seconds = pool.apply(_scratch_merge_in_child,
+                                                           (fixtures[:count], output_file, duration, budget))
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            pcm_mb = count * duration * 44100 * 4 / 1024 / 1024
+            ok = mode == 'ram' or peak_mb <= rss_ceiling_mb
+            results['ok'] = results['ok'] and ok
+            results[f"{mode}-{count}"] = {'peak_rss_mb': peak_mb, 'wall': elapsed, 'pcm_mb': pcm_mb,
+                                          'seconds': seconds}
+            print(f"  {mode:<7} clips={count:<3} PCM={pcm_mb:.0f} MB peak RSS={peak_mb:.0f} MB "
+                  f"wall={elapsed:.2f}s{'' if ok else '  ✗ over the ceiling'}")
+    return results
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def bench_single_pass(num_files=12, duration=25, video_seconds=60):
+    """Compare trim + merge as separate steps with the single ffmpeg pass"""
+    from pydub import AudioSegment
+    from audio_merge import stream_merge, ffmpeg_mashup
+
+    fixtures = generate_fixtures(num_files, video_seconds)
+
+    def steps(output_dir, output_file):
+        trimmed = []
+        for path in fixtures:
+            trimmed_path = os.path.join(output_dir, 'trimmed_' + os.path.basename(path))
+            AudioSegment.from_mp3(path)[:duration * 1000].export(trimmed_path, format='mp3')
+            trimmed.append(trimmed_path)
+        stream_merge(trimmed, output_file)
+
+    def single_pass(output_dir, output_file):
+        ffmpeg_mashup(fixtures, duration, output_file)
+
+    print(f"\n🎛️  Pipeline backends: {num_files} files, first {duration}s each")
+    results = {}
+    for backend, run in (('steps', steps), ('ffmpeg', single_pass)):
+        output_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+        try:
+            output_file = os.path.join(output_dir, 'mashup.mp3')
+            cpu_before = _children_cpu()
+            start = time.perf_counter()
+            run(output_dir, output_file)
+            elapsed = time.perf_counter() - start
+            cpu = _children_cpu() - cpu_before
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        results[backend] = {'wall': elapsed, 'ffmpeg_cpu': cpu}
+        print(f"  {backend:<6} wall={elapsed:.2f}s ffmpeg cpu={cpu:.2f}s")
+    return results
+
+
+def bench_search_cache(requests=(30, 25, 12, 30), search_latency=2.0):
+    """Repeated searches for one singer, with and without the search cache"""
+    from audio_cache import SearchCache
+    from downloader import build_ydl_opts, search_videos
+
+    FakeYoutubeDL.fixtures = generate_fixtures(max(requests), 30)
+    FakeYoutubeDL.search_latency = search_latency
+    ydl_opts = build_ydl_opts(tempfile.gettempdir())
+
+    print(f"\n🔎 Search cache: requests for N={list(requests)}, {search_latency}s per search")
+    results = {}
+    cache_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+    try:
+        for label, cache in (('no cache', None),
+                             ('cache', SearchCache(os.path.join(cache_dir, 'search.sqlite3'), 3600))):
+            FakeYoutubeDL.search_calls = 0
+            start = time.perf_counter()
+            for count in requests:
+                search_videos('Fake  Singer', count, ydl_opts, ydl_class=FakeYoutubeDL, cache=cache)
+            elapsed = time.perf_counter() - start
+            results[label] = {'search_calls': FakeYoutubeDL.search_calls, 'wall': elapsed}
+            print(f"  {label:<8} searches={FakeYoutubeDL.search_calls} wall={elapsed:.2f}s")
+    finally:
+        FakeYoutubeDL.search_latency = 0.0
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def in_memory_message(to_email, zip_file):
+    """The email as the old send_email built it (whole attachment base64-encoded in memory)"""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.base import MIMEBase
+    from email.mime.text import MIMEText
+    from email import encoders
+    import mailer
+
+    msg = MIMEMultipart()
+    msg['From'] = mailer.SMTP_EMAIL
+    msg['To'] = to_email
+    msg['Subject'] = "Mashup Result"
+    msg.attach(MIMEText(mailer.MAIL_BODY, 'plain'))
+    with open(zip_file, 'rb') as attachment:
+        part = MIMEBase('application', 'zip')
+        part.set_payload(attachment.read())
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename={os.path.basename(zip_file)}')
+        msg.attach(part)
+    return msg
+
+
+def start_smtp_server(handshake=0.0, received=None):
+    """
+    Local SMTP stand-in (aiosmtpd) whose EHLO takes `handshake` seconds, like
+    TLS + login. Message contents are appended to `received` if given.
+    """
+    import asyncio
+    from aiosmtpd.controller import Controller
+
+    class Handler:
+        async def handle_EHLO(self, server, session, envelope, hostname, responses):
+            await asyncio.sleep(handshake)
+            session.host_name = hostname
+            return responses
+
+        async def handle_DATA(self, server, session, envelope):
+            if received is not None:
+                received.append(envelope.content)
+            return '250 OK'
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    controller = Controller(Handler(), hostname='127.0.0.1', port=port, data_size_limit=None)
+    controller.start()
+    return controller, port
+
+
+def bench_email_delivery(messages=20, handshake=0.2, attachment_mb=2):
+    """One SMTP connection per email (old send_email) vs the pooled delivery process"""
+    try:
+        import aiosmtpd  # noqa: F401
+    except ImportError:
+        print("\n📧 Email delivery: skipped (pip install aiosmtpd)")
+        return None
+    import smtplib
+    import mailer
+
+    mailer.SMTP_STARTTLS = False
+    mailer.SMTP_EMAIL = 'bench@example.com'
+    controller, port = start_smtp_server(handshake)
+    work_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+    zip_file = os.path.join(work_dir, 'mashup.zip')
+    with open(zip_file, 'wb') as f:
+        f.write(os.urandom(attachment_mb * 1024 * 1024))
+
+    print(f"\n📧 Email delivery: {messages} emails, {attachment_mb} MB attachment, {handshake}s handshake")
+    results = {}
+    try:
+        start = time.perf_counter()
+        for number in range(messages):
+            server = smtplib.SMTP('127.0.0.1', port)
+            server.send_message(in_memory_message(f"user{number}@example.com", zip_file))
+            server.quit()
+        elapsed = time.perf_counter() - start
+        results['per-message'] = {'wall': elapsed, 'connections': messages}
+        print(f"  per-message wall={elapsed:.2f}s connections={messages}")
+
+        outbox = mailer.Outbox(os.path.join(work_dir, 'outbox.sqlite3'), os.path.join(work_dir, 'spool'))
+        outbox.add('bench', [f"user{number}@example.com" for number in range(messages)], zip_file)
+        connections = [mailer.SMTPConnection('127.0.0.1', port) for _ in range(mailer.SMTP_CONNECTIONS)]
+        stop = threading.Event()
+        start = time.perf_counter()
+        threads = [threading.Thread(target=mailer.sender_loop, args=(outbox, connection, stop))
+                   for connection in connections]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            while outbox.stats()['queue_depth']:
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            stop.set()
+            for thread in threads:
+                thread.join()
+        stats = outbox.stats()
+        connects = sum(connection.connects for connection in connections)
+        results['pooled'] = {'wall': elapsed, 'connections': connects, **stats}
+        print(f"  pooled      wall={elapsed:.2f}s connections={connects} "
+              f"send avg={stats['send_ms_avg']}ms p95={stats['send_ms_p95']}ms")
+    finally:
+        controller.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _send_in_child(mode, port, zip_file):
+    """Send one email the old (in-memory MIME) or new (streamed) way, return peak RSS in MB"""
+    import smtplib
+    import mailer
+
+    mailer.SMTP_STARTTLS = False
+    mailer.SMTP_EMAIL = 'bench@example.com'
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    if mode == 'in-memory':
+        server = smtplib.SMTP('127.0.0.1', port)
+        server.send_message(in_memory_message('user@example.com', zip_file))
+        server.quit()
+    else:
+        connection = mailer.SMTPConnection('127.0.0.1', port)
+        connection.send('user@example.com', zip_file)
+        connection.close()
+    elapsed = time.perf_counter() - start
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - baseline, elapsed
+
+
+def bench_zip_and_mime(mashup_seconds=1800):
+    """ZIP_DEFLATED vs ZIP_STORED for the mashup, and peak memory of in-memory vs streamed MIME"""
+    import zipfile
+
+    work_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+    mp3_file = os.path.join(work_dir, 'mashup.mp3')
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i',
+                    f'anoisesrc=d={mashup_seconds}:a=0.3', '-ac', '2', '-b:a', '192k', mp3_file], check=True)
+    size_mb = os.path.getsize(mp3_file) / 1024 / 1024
+
+    print(f"\n🗜️  Zip + MIME: {size_mb:.0f} MB mashup")
+    results = {}
+    try:
+        zip_file = os.path.join(work_dir, 'mashup.zip')
+        for label, compression in (('deflated', zipfile.ZIP_DEFLATED), ('stored', zipfile.ZIP_STORED)):
+            start = time.perf_counter()
+            cpu = time.process_time()
+            with zipfile.ZipFile(zip_file, 'w', compression) as zipf:
+                zipf.write(mp3_file, os.path.basename(mp3_file))
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            zip_mb = os.path.getsize(zip_file) / 1024 / 1024
+            results[f"zip-{label}"] = {'wall': elapsed, 'cpu': cpu, 'size_mb': zip_mb}
+            print(f"  zip {label:<9} wall={elapsed:.2f}s cpu={cpu:.2f}s size={zip_mb:.1f} MB")
+
+        try:
+            import aiosmtpd  # noqa: F401
+        except ImportError:
+            print("  MIME: skipped (pip install aiosmtpd)")
+            return results
+
+        received = []
+        controller, port = start_smtp_server(received=received)
+        context = multiprocessing.get_context('spawn')
+        try:
+            for mode in ('in-memory', 'streamed'):
+                with context.Pool(1) as pool:
+                    peak_mb, elapsed = pool.apply(_send_in_child, (mode, port, zip_file))
+                results[f"mime-{mode}"] = {'extra_rss_mb': peak_mb, 'wall': elapsed}
+                print(f"  mime {mode:<9} extra peak RSS={peak_mb:.0f} MB wall={elapsed:.2f}s")
+        finally:
+            controller.stop()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _directory_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def _reset_peak_rss():
+    """Reset this process's RSS high-water mark (Linux only), returns whether it worked"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    """Peak RSS of this process since the last reset (VmHWM), or over its lifetime (ru_maxrss)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(function, output_path=None):
+    """
+    Run function, return (result, wall/cpu/peak RSS/bytes written of the call).
+
+    peak_rss_mb is this process's peak during the call (its lifetime peak where
+    the high-water mark cannot be reset). Subprocesses are not included: their
+    ru_maxrss starts from this process's RSS at fork time, so it says nothing
+    about the subprocess itself.
+    """
+    self_start = resource.getrusage(resource.RUSAGE_SELF)
+    children_cpu = _children_cpu()
+    peak_reset = _reset_peak_rss()
+    bytes_before = _directory_bytes(output_path) if output_path and os.path.exists(output_path) else 0
+    start = time.perf_counter()
+    result = function()
+    wall = time.perf_counter() - start
+    self_end = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (self_end.ru_utime - self_start.ru_utime + self_end.ru_stime - self_start.ru_stime
+           + _children_cpu() - children_cpu)
+    peak_rss = _peak_rss_mb()
+    written = (_directory_bytes(output_path) if output_path and os.path.exists(output_path) else 0) - bytes_before
+    return result, {
+        'wall': round(wall, 3),
+        'cpu': round(cpu, 3),
+        'peak_rss_mb': round(peak_rss, 1),
+        'peak_rss_per_stage': peak_reset,
+        'bytes_written': written,
+    }
+
+
+def _pipeline_in_child(fixtures, num_videos, duration, latency, work_dir):
+    """
+    Run search -> download -> trim -> merge -> zip once (in a fresh process) and
+    measure every stage. Caches are off so each run does the full work, and
+    metrics go to a store in work_dir instead of the service's.
+    """
+    os.environ.update({'AUDIO_CACHE_DIR': '', 'TRIM_CACHE_DIR': '', 'SEARCH_CACHE_TTL': '0',
+                       'OVERLAP_STAGES': '0',
+                       'METRICS_DB_PATH': os.path.join(work_dir, 'metrics.sqlite3')})
+    with contextlib.redirect_stdout(io.StringIO()):
+        import pipeline
+
+        FakeYoutubeDL.fixtures = fixtures
+        FakeYoutubeDL.latency = latency
+        downloads = os.path.join(work_dir, 'downloads')
+        trimmed_dir = os.path.join(work_dir, 'trimmed')
+        os.makedirs(trimmed_dir)
+        output_mp3 = os.path.join(work_dir, 'mashup.mp3')
+        output_zip = os.path.join(work_dir, 'mashup.zip')
+
+        stages = {}
+        start = time.perf_counter()
+        downloaded, stages['download'] = _measure(
+            lambda: pipeline.download_videos('fake singer', num_videos, duration, ydl_class=FakeYoutubeDL,
+                                        output_dir=downloads), downloads)
+        trimmed, stages['trim'] = _measure(lambda: pipeline.trim_audio(downloaded, duration, trimmed_dir=trimmed_dir),
+                                           trimmed_dir)
+        _, stages['merge'] = _measure(lambda: pipeline.merge_audios(trimmed, output_mp3, duration=duration),
+                                      output_mp3)
+        _, stages['zip'] = _measure(lambda: pipeline.create_zip(output_mp3, output_zip), output_zip)
+        wall = time.perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    end_to_end = {
+        'wall': round(wall, 3),
+        'cpu': round(usage.ru_utime + usage.ru_stime + _children_cpu(), 3),
+        # Resetting the high-water mark per stage resets ru_maxrss as well
+        'peak_rss_mb': max(max(stage['peak_rss_mb'] for stage in stages.values()),
+                           round(usage.ru_maxrss / 1024, 1)),
+        'bytes_written': sum(stage['bytes_written'] for stage in stages.values()),
+        'clips': len(trimmed),
+    }
+    return stages, end_to_end
+
+
+def bench_pipeline(sizes=((12, 25), (24, 25), (12, 60)), video_seconds=90, latency=0.0):
+    """Per-stage and end-to-end wall, CPU, peak RSS and bytes written at several (N, duration) sizes"""
+    context = multiprocessing.get_context('spawn')
+    print(f"\n🏁 Pipeline: (N, duration) = {list(sizes)}, {video_seconds}s fixtures, {latency}s latency")
+    results = []
+    for num_videos, duration in sizes:
+        fixtures = generate_fixtures(num_videos, video_seconds)
+        work_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+        try:
+            # Not a multiprocessing.Pool: its daemonic workers cannot start the trim pool
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                stages, end_to_end = pool.submit(_pipeline_in_child, fixtures, num_videos, duration,
+                                                 latency, work_dir).result()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results.append({'num_videos': num_videos, 'duration': duration,
+                        'stages': stages, 'end_to_end': end_to_end})
+        print(f"  N={num_videos:<3} Y={duration:<3} wall={end_to_end['wall']:.2f}s cpu={end_to_end['cpu']:.2f}s "
+              f"peak RSS={end_to_end['peak_rss_mb']:.0f} MB written={end_to_end['bytes_written'] / 1e6:.1f} MB")
+        for name, stage in stages.items():
+            print(f"    {name:<9} wall={stage['wall']:.2f}s cpu={stage['cpu']:.2f}s "
+                  f"peak RSS={stage['peak_rss_mb']:.0f} MB written={stage['bytes_written'] / 1e6:.1f} MB")
+    return results
+
+
+# Modules the web workers should not load (they belong to the job workers)
+HEAVY_MODULES = ('yt_dlp', 'pydub', 'trimming', 'pipeline')
+
+IMPORT_CHILD = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+SERVE_CHILD = """
+import sys
+from werkzeug.serving import make_server
+import app
+make_server('127.0.0.1', int(sys.argv[1]), app.app).serve_forever()
+"""
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def bench_startup(runs=5):
+    """Cold import time of the web app and the pipeline, and process start to first response of /"""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    work_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+    env = dict(os.environ, PYTHONPATH=repo)
+
+    print(f"\n🚀 Startup: median of {runs} fresh processes")
+    results = {}
+    try:
+        for module in ('app', 'pipeline'):
+            times, heavy = [], []
+            for _ in range(runs):
+                output = subprocess.run([sys.executable, '-c', IMPORT_CHILD.format(module=module, heavy=HEAVY_MODULES)],
+                                        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                                        cwd=work_dir, env=env, check=True).stdout
+                run = json.loads(output.strip().splitlines()[-1])
+                times.append(run['seconds'])
+                heavy = run['heavy']
+            results[f"import-{module}"] = {'median': statistics.median(times), 'first': times[0],
+                                            'heavy_modules': heavy}
+            print(f"  import {module:<9} median={statistics.median(times) * 1000:.0f} ms "
+                  f"first={times[0] * 1000:.0f} ms heavy modules loaded: {', '.join(heavy) or 'none'}")
+
+        times = []
+        for _ in range(runs):
+            port = _free_port()
+            start = time.perf_counter()
+            server = subprocess.Popen([sys.executable, '-c', SERVE_CHILD, str(port)], cwd=work_dir, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                while True:
+                    try:
+                        with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5) as response:
+                            response.read()
+                        break
+                    except OSError:
+                        if server.poll() is not None:
+                            raise Exception("The web app exited before answering")
+                        time.sleep(0.005)
+                times.append(time.perf_counter() - start)
+            finally:
+                server.terminate()
+                server.wait()
+        results['first-response'] = {'median': statistics.median(times), 'first': times[0]}
+        print(f"  first response   median={statistics.median(times) * 1000:.0f} ms "
+              f"first={times[0] * 1000:.0f} ms (process start to 200 from /)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def environment():
+    """Machine and tool versions, stored with the results"""
+    ffmpeg = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            text=True).stdout.split('\n')[0]
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'ffmpeg': ffmpeg,
+    }
+
+
+def compare(results, baseline_path, threshold=0.10):
+    """Print pipeline stages whose wall time changed by more than threshold since baseline"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(run['num_videos'], run['duration']): run for run in baseline.get('pipeline') or []}
+
+    print(f"\n📈 Compared with {baseline_path} ({baseline['environment'].get('commit')})")
+    changed = 0
+    for run in results.get('pipeline') or []:
+        old = before.get((run['num_videos'], run['duration']))
+        if not old:
+            continue
+        for name, stage in list(run['stages'].items()) + [('end-to-end', run['end_to_end'])]:
+            old_stage = old['end_to_end'] if name == 'end-to-end' else old['stages'].get(name)
+            if not old_stage or not old_stage['wall']:
+                continue
+            change = stage['wall'] / old_stage['wall'] - 1
+            if abs(change) > threshold:
+                changed += 1
+                print(f"  N={run['num_videos']} Y={run['duration']} {name:<10} "
+                      f"{old_stage['wall']:.2f}s -> {stage['wall']:.2f}s ({change:+.0%})")
+    if not changed:
+        print(f"  No stage changed by more than {threshold:.0%}")
+
+
+BENCHMARKS = {
+    'download_pool': bench_download_pool,
+    'search_cache': bench_search_cache,
+    'head_only': bench_head_only,
+    'trim_engines': bench_trim_engines,
+    'trim_scaling': bench_trim_scaling,
+    'stage_overlap': bench_stage_overlap,
+    'merge_memory': bench_merge_memory,
+    'single_pass': bench_single_pass,
+    'email_delivery': bench_email_delivery,
+    'zip_and_mime': bench_zip_and_mime,
+    'startup': bench_startup,
+    'low_memory': bench_low_memory,
+}
+
+
+def parse_sizes(text):
+    """'12x25,24x25' -> [(12, 25), (24, 25)]"""
+    return [tuple(int(part) for part in size.split('x')) for size in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline mashup benchmarks")
+    parser.add_argument('--only', help="Comma separated benchmarks to run: pipeline, " + ', '.join(BENCHMARKS))
+    parser.add_argument('--sizes', type=parse_sizes, default=((12, 25), (24, 25), (12, 60)),
+                        help="Pipeline sizes as NxDURATION,... (default 12x25,24x25,12x60)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Simulated download latency in seconds for the pipeline runs")
+    parser.add_argument('--json', help="Write all results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON file to compare the pipeline results with")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("⏱️  MASHUP ASSIGNMENT - BENCHMARKS")
+    print("=" * 60)
+
+    if shutil.which('ffmpeg') is None:
+        print("❌ FFmpeg not found, it is needed to generate fixtures")
+        sys.exit(1)
+
+    selected = args.only.split(',') if args.only else ['pipeline'] + list(BENCHMARKS)
+    results = {'environment': environment(), 'benchmarks': {}, 'pipeline': None}
+    if 'pipeline' in selected:
+        results['pipeline'] = bench_pipeline(args.sizes, latency=args.latency)
+    for name, bench in BENCHMARKS.items():
+        if name in selected:
+            results['benchmarks'][name] = bench()
+
+    if args.compare:
+        compare(results, args.compare)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"\n💾 Results written to {args.json}")
+
+    print("=" * 60)
+    low_memory = results['benchmarks'].get('low_memory')
+    if low_memory and not low_memory['ok']:
+        print("❌ The low-memory merge went over its RSS ceiling")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
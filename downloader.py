@@ -0,0 +1,270 @@
+"""
+Mashup Assignment - Shared Downloader
+Search and per-video download helpers used by both programs
+"""
+
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import download_range_func
+
+
+# Number of videos downloaded at the same time (can be overridden per call)
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '4'))
+
+# Head-only mode: only fetch the first `duration` seconds of every video
+HEAD_ONLY_DOWNLOADS = os.environ.get('HEAD_ONLY_DOWNLOADS', '1') != '0'
+
+# Extra seconds fetched past the clip length so the trim never comes up short
+HEAD_MARGIN_SECONDS = float(os.environ.get('HEAD_MARGIN_SECONDS', '2'))
+
+# Longer videos are compilations or live archives, not songs
+MAX_VIDEO_SECONDS = int(os.environ.get('MAX_VIDEO_SECONDS', '900'))
+
+# Search this many times more candidates than needed, so rejected or failed
+# entries can be replaced and exactly N videos end up downloaded
+SEARCH_OVERFETCH = float(os.environ.get('SEARCH_OVERFETCH', '2'))
+
+# live_status values of entries that are not finished uploads
+LIVE_STATUSES = ('is_live', 'is_upcoming', 'post_live')
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+
+def build_ydl_opts(output_dir='downloads', quiet=True, ffmpeg_location=None, head_seconds=None,
+                   extract_audio=True):
+    """
+    Build the yt-dlp options shared by the search and download steps.
+
+    When head_seconds is set only that many seconds (plus HEAD_MARGIN_SECONDS)
+    are downloaded and converted, so the cost follows the clip length instead
+    of the video length. With extract_audio=False the downloaded audio is kept
+    in its original format (no FFmpegExtractAudio step).
+    """
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+        # Video id keeps parallel downloads with the same title apart
+        'outtmpl': os.path.join(output_dir, '%(title)s [%(id)s].%(ext)s'),
+        'quiet': quiet,
+        'no_warnings': quiet,
+        'ignoreerrors': True,
+        # Anti-bot detection measures
+        'extractor_args': {'youtube': {'player_client': ['android', 'web']}},
+        'user_agent': USER_AGENT,
+    }
+
+    if not extract_audio:
+        del ydl_opts['postprocessors']
+
+    if ffmpeg_location:
+        ydl_opts['ffmpeg_location'] = ffmpeg_location
+
+    if head_seconds:
+        # yt-dlp hands section downloads to ffmpeg, which stops reading at -t
+        head_end = head_seconds + HEAD_MARGIN_SECONDS
+        ydl_opts['download_ranges'] = download_range_func(None, [(0, head_end)])
+
+    # Use cookies if available
+    if os.path.exists('youtube_cookies.txt'):
+        ydl_opts['cookiefile'] = 'youtube_cookies.txt'
+
+    return ydl_opts
+
+
+def search_videos(singer_name, num_videos, ydl_opts, ydl_class=YoutubeDL, cache=None):
+    """
+    Resolve the ytsearch query into a list of entries without downloading.
+
+    With a SearchCache, a fresh cached result (for at least num_videos) is
+    returned without contacting YouTube.
+    """
+    if cache:
+        entries = cache.get(singer_name, num_videos)
+        if entries is not None:
+            return entries
+
+    search_opts = dict(ydl_opts)
+    search_opts['extract_flat'] = 'in_playlist'
+    search_opts.pop('postprocessors', None)
+
+    search_query = f"ytsearch{num_videos}:{singer_name}"
+
+    with ydl_class(search_opts) as ydl:
+        info = ydl.extract_info(search_query, download=False)
+
+    entries = []
+    for entry in (info or {}).get('entries') or []:
+        if not entry or not entry.get('id'):
+            continue
+        entries.append({
+            'id': entry['id'],
+            'url': entry.get('url') or entry.get('webpage_url') or entry['id'],
+            'title': entry.get('title') or entry['id'],
+            'duration': entry.get('duration'),
+            'live_status': entry.get('live_status') or ('is_live' if entry.get('is_live') else None),
+        })
+
+    if cache:
+        cache.put(singer_name, num_videos, entries)
+    return entries
+
+
+def search_count(num_videos):
+    """How many candidates to search for when num_videos are needed"""
+    return max(num_videos, int(math.ceil(num_videos * SEARCH_OVERFETCH)))
+
+
+def filter_entries(entries, clip_seconds=None, max_seconds=None):
+    """
+    Drop candidates that are not worth downloading, using search metadata only.
+
+    Rejects duplicate ids, live/upcoming streams, shorts, videos shorter than
+    the clip and videos longer than max_seconds (MAX_VIDEO_SECONDS by default).
+    Entries without a known duration are kept. Returns (kept, rejected) where
+    rejected is a list of (entry, reason).
+    """
+    max_seconds = max_seconds or MAX_VIDEO_SECONDS
+    kept = []
+    rejected = []
+    seen = set()
+    for entry in entries:
+        duration = entry.get('duration')
+        if entry['id'] in seen:
+            reason = 'duplicate'
+        elif entry.get('live_status') in LIVE_STATUSES:
+            reason = 'live stream'
+        elif '/shorts/' in (entry.get('url') or ''):
+            reason = 'short'
+        elif duration and clip_seconds and duration < clip_seconds:
+            reason = f"shorter than {clip_seconds}s"
+        elif duration and duration > max_seconds:
+            reason = f"longer than {max_seconds}s"
+        else:
+            reason = None
+
+        if reason:
+            rejected.append((entry, reason))
+        else:
+            kept.append(entry)
+        seen.add(entry['id'])
+    return kept, rejected
+
+
+def cache_format(ydl_opts):
+    """Cache key part describing what the download options produce"""
+    for postprocessor in ydl_opts.get('postprocessors') or []:
+        if postprocessor.get('key') == 'FFmpegExtractAudio':
+            return f"{postprocessor['preferredcodec']}-{postprocessor['preferredquality']}"
+    return f"raw-{ydl_opts.get('format')}"
+
+
+def _downloaded_path(ydl, info):
+    """Find the final file yt-dlp produced for an entry (after postprocessing)"""
+    for download in info.get('requested_downloads') or []:
+        if download.get('filepath'):
+            return download['filepath']
+    filename = ydl.prepare_filename(info)
+    if ydl.params.get('postprocessors'):
+        return os.path.splitext(filename)[0] + '.mp3'
+    return filename
+
+
+def download_entry(entry, ydl_opts, ydl_class=YoutubeDL, cache=None, head_seconds=None,
+                   clip_seconds=None, on_fetch=None):
+    """
+    Download a single entry (and extract its audio), returns the file path.
+
+    A cached download is only reused if it covers clip_seconds (the whole
+    video when no clip length is given), so a head-only download stored by
+    a shorter job is never served for a longer clip. on_fetch(file_path) is
+    called for downloads that went to the network (not cache hits).
+    """
+    if cache:
+        output_dir = os.path.dirname(ydl_opts['outtmpl']) or '.'
+        key = cache.make_key(entry['id'], cache_format(ydl_opts))
+        min_coverage = clip_seconds or head_seconds or math.inf
+        cached_path = cache.get(key, output_dir, min_coverage=min_coverage)
+        if cached_path:
+            return cached_path
+
+    # Each worker gets its own YoutubeDL instance, they are not thread safe
+    with ydl_class(ydl_opts) as ydl:
+        info = ydl.extract_info(entry['url'], download=True)
+        if not info:
+            raise Exception(f"Could not download {entry['title']}")
+        file_path = _downloaded_path(ydl, info)
+
+    if not os.path.exists(file_path):
+        raise Exception(f"Audio file missing after download: {file_path}")
+    if on_fetch:
+        on_fetch(file_path)
+
+    if cache:
+        cache.put(key, file_path, coverage=head_seconds)
+    return file_path
+
+
+def download_entries(entries, ydl_opts, max_workers=None, ydl_class=YoutubeDL, on_result=None,
+                     cache=None, head_seconds=None, clip_seconds=None, on_fetch=None):
+    """
+    Download entries on a bounded thread pool.
+
+    on_result(index, entry, file_path, error) is called as each download
+    finishes. Returned paths keep the search order, failed entries are left out.
+    With a cache, entries already downloaded by an earlier job (covering at
+    least clip_seconds) are served from disk instead of the network.
+    """
+    if not entries:
+        return []
+
+    max_workers = max(1, min(max_workers or DOWNLOAD_WORKERS, len(entries)))
+    results = [None] * len(entries)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(download_entry, entry, ydl_opts, ydl_class, cache, head_seconds,
+                        clip_seconds, on_fetch): index
+            for index, entry in enumerate(entries)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            file_path = None
+            error = None
+            try:
+                file_path = future.result()
+                results[index] = file_path
+            except Exception as e:
+                error = e
+            if on_result:
+                on_result(index, entries[index], file_path, error)
+
+    return [path for path in results if path]
+
+
+def download_first(entries, num_videos, ydl_opts, on_result=None, **kwargs):
+    """
+    Download entries in order until num_videos of them succeed.
+
+    Each round downloads just enough of the next candidates to replace the
+    ones that failed, so no more than num_videos downloads run at once and
+    no extra videos are fetched. on_result gets the index into entries.
+    Extra keyword arguments are passed to download_entries.
+    """
+    downloaded = []
+    position = 0
+    while len(downloaded) < num_videos and position < len(entries):
+        batch = entries[position:position + num_videos - len(downloaded)]
+
+        def report(index, entry, file_path, error, offset=position):
+            if on_result:
+                on_result(offset + index, entry, file_path, error)
+
+        downloaded.extend(download_entries(batch, ydl_opts, on_result=report, **kwargs))
+        position += len(batch)
+    return downloaded
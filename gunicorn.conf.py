@@ -0,0 +1,38 @@
+"""
+Gunicorn configuration
+Starts the mashup job workers (worker.py) next to the web workers
+"""
+
+import os
+import sys
+import subprocess
+
+
+# Set to 0 when the job workers run as a separate service
+START_JOB_WORKERS = os.environ.get('START_JOB_WORKERS', '1') != '0'
+
+# Import the app once in the master and fork the web workers from it, so a worker
+# boot (or restart after a timeout) does not import Flask and the app again
+preload_app = os.environ.get('PRELOAD_APP', '1') != '0'
+
+job_workers = None
+
+
+def on_starting(server):
+    # Look up ffmpeg once, the web and job workers inherit the result
+    from audio_merge import probe_ffmpeg
+    probe_ffmpeg()
+
+
+def when_ready(server):
+    global job_workers
+    if START_JOB_WORKERS:
+        server.log.info("Starting mashup job workers")
+        worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+        job_workers = subprocess.Popen([sys.executable, worker_script])
+
+
+def on_exit(server):
+    if job_workers and job_workers.poll() is None:
+        job_workers.terminate()
+        job_workers.wait(timeout=30)
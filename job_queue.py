@@ -0,0 +1,256 @@
+"""
+Mashup Assignment - Job Queue
+Durable SQLite-backed queue of mashup jobs shared by the web and worker processes
+"""
+
+import os
+import time
+import json
+import uuid
+import sqlite3
+import threading
+from metrics import update_stages
+
+
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join('data', 'jobs.sqlite3'))
+
+# Admission control: /process refuses new jobs while this many are waiting or running
+MAX_PENDING_JOBS = int(os.environ.get('MAX_PENDING_JOBS', '20'))
+
+# A running job whose worker has not checked in for this long is considered interrupted
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+
+# Interrupted jobs are retried until they have been started this many times
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+
+
+class QueueFullError(Exception):
+    """Raised by enqueue() when admission control rejects a job"""
+
+
+class JobQueue:
+    """
+    Jobs table in SQLite (WAL mode) used as a work queue.
+
+    Workers claim the oldest queued job atomically, send heartbeats while
+    running it and mark it done or failed. Jobs left 'running' by a worker
+    that died (or a restart) are put back in the queue by recover().
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or JOB_DB_PATH
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                singer_name TEXT, num_videos INTEGER, duration INTEGER, email TEXT,
+                status TEXT, attempts INTEGER DEFAULT 0, error TEXT,
+                created REAL, started REAL, finished REAL, heartbeat REAL, worker TEXT,
+                stage TEXT, stages TEXT, job_key TEXT)''')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+            columns = [row[1] for row in db.execute('PRAGMA table_info(jobs)')]
+            for column in ('stage', 'stages', 'job_key'):
+                if column not in columns:
+                    db.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_key ON jobs (job_key, status)')
+            db.execute('''CREATE TABLE IF NOT EXISTS recipients (
+                job_id TEXT, email TEXT, created REAL, PRIMARY KEY (job_id, email))''')
+            db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def _connect(self):
+        """One connection per thread (sqlite connections are not shared)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def job_key(singer_name, num_videos, duration):
+        """Requests with the same key produce the same mashup"""
+        return f"{' '.join(singer_name.lower().split())}|{num_videos}|{duration}"
+
+    def enqueue(self, singer_name, num_videos, duration, email):
+        """
+        Add a job and return (job_id, coalesced).
+
+        If an identical job (same job_key) is queued or running and has not
+        reached its email stage yet, the email is added to that job's
+        recipients instead and its id is returned with coalesced=True.
+        Raises QueueFullError when too many jobs are pending.
+        """
+        job_id = uuid.uuid4().hex
+        job_key = self.job_key(singer_name, num_videos, duration)
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            existing = db.execute("SELECT id FROM jobs WHERE job_key = ? "
+                                  "AND (status = 'queued' OR (status = 'running' "
+                                  "AND COALESCE(stage, '') != 'email')) "
+                                  "ORDER BY created LIMIT 1", (job_key,)).fetchone()
+            if existing:
+                db.execute('INSERT OR IGNORE INTO recipients VALUES (?, ?, ?)',
+                           (existing['id'], email, time.time()))
+                self._count(db, 'coalesced')
+                return existing['id'], True
+
+            pending = db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+                                 ).fetchone()[0]
+            if pending >= MAX_PENDING_JOBS:
+                raise QueueFullError(f"Server is busy ({pending} mashups in progress), please try again later")
+            db.execute("INSERT INTO jobs (id, singer_name, num_videos, duration, email, status, "
+                       "created, job_key) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                       (job_id, singer_name, num_videos, duration, email, time.time(), job_key))
+            db.execute('INSERT INTO recipients VALUES (?, ?, ?)', (job_id, email, time.time()))
+            self._count(db, 'enqueued')
+        return job_id, False
+
+    def _count(self, db, name, amount=1):
+        db.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                   'ON CONFLICT(name) DO UPDATE SET value = value + ?', (name, amount, amount))
+
+    def recipients(self, job_id):
+        """Every email address waiting for job_id's result"""
+        rows = self._connect().execute('SELECT email FROM recipients WHERE job_id = ? ORDER BY created',
+                                       (job_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def claim(self, worker):
+        """Mark the oldest queued job as running for worker and return it (or None)"""
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            job = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+                             ).fetchone()
+            if job is None:
+                return None
+            now = time.time()
+            # A retried job starts reporting progress from scratch
+            db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                       "started = ?, heartbeat = ?, worker = ?, stage = NULL, stages = NULL "
+                       "WHERE id = ?",
+                       (now, now, worker, job['id']))
+        return dict(job)
+
+    def heartbeat(self, job_id):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running'",
+                       (time.time(), job_id))
+
+    def set_progress(self, job_id, stage, done=None, total=None):
+        """
+        Record that job_id is in stage (with done/total items for counted stages).
+
+        Stage start/finish times are kept so the status API can report elapsed
+        time and an ETA without looking at the job's files.
+        """
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT stage, stages FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            now = time.time()
+            stages = json.loads(row['stages'] or '[]')
+            update_stages(stages, stage, done, total, now)
+            # The current stage is the newest one, trims report while downloads still run
+            db.execute('UPDATE jobs SET stage = ?, stages = ?, heartbeat = ? WHERE id = ?',
+                       (stages[-1]['name'], json.dumps(stages), now, job_id))
+
+    def complete(self, job_id):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'done', finished = ?, error = NULL WHERE id = ?",
+                       (time.time(), job_id))
+
+    def fail(self, job_id, error):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?",
+                       (time.time(), str(error), job_id))
+
+    def recover(self, lease_seconds=None):
+        """
+        Requeue running jobs whose worker stopped sending heartbeats.
+
+        Jobs that already used up JOB_MAX_ATTEMPTS are failed instead.
+        Returns the number of jobs requeued.
+        """
+        cutoff = time.time() - (JOB_LEASE_SECONDS if lease_seconds is None else lease_seconds)
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute("UPDATE jobs SET status = 'failed', finished = ?, "
+                       "error = 'Interrupted too many times' "
+                       "WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+                       (time.time(), cutoff, JOB_MAX_ATTEMPTS))
+            requeued = db.execute("UPDATE jobs SET status = 'queued', worker = NULL "
+                                  "WHERE status = 'running' AND heartbeat < ?", (cutoff,)).rowcount
+        return requeued
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def status(self, job_id):
+        """Public view of a job: status, current stage, per-stage elapsed time and ETA"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        now = time.time()
+        stages = []
+        for stage in json.loads(job['stages'] or '[]'):
+            end = stage['finished'] or (job['finished'] if job['status'] in ('done', 'failed') else None)
+            elapsed = (end or now) - stage['started']
+            eta = None
+            if not end and stage.get('total') and stage.get('done'):
+                eta = elapsed / stage['done'] * (stage['total'] - stage['done'])
+            stages.append({
+                'name': stage['name'],
+                'done': stage.get('done'),
+                'total': stage.get('total'),
+                'elapsed': round(elapsed, 1),
+                'eta': round(eta, 1) if eta is not None else None,
+                'finished': end is not None,
+            })
+
+        status = {
+            'id': job['id'],
+            'status': job['status'],
+            'stage': job['stage'],
+            'stages': stages,
+            'error': job['error'],
+            'attempts': job['attempts'],
+        }
+        if job['status'] == 'queued':
+            status['position'] = self._connect().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?",
+                (job['created'],)).fetchone()[0] + 1
+        return status
+
+    def counts(self):
+        """Number of jobs per status"""
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def stats(self):
+        """Jobs per status plus enqueued/coalesced request counters"""
+        counters = dict(self._connect().execute('SELECT name, value FROM counters').fetchall())
+        return {
+            'jobs': self.counts(),
+            'enqueued': counters.get('enqueued', 0),
+            'coalesced': counters.get('coalesced', 0),
+        }
+
+
+_job_queue = None
+
+
+def get_job_queue():
+    """The job queue of this process (opened on first use)"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
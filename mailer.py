@@ -0,0 +1,432 @@
+"""
+Mashup Assignment - Email Delivery
+Outbound email queue sent by a separate delivery process over pooled SMTP connections
+"""
+
+import os
+import time
+import uuid
+import base64
+import shutil
+import sqlite3
+import smtplib
+import threading
+from email.utils import formatdate, make_msgid
+from job_queue import JOB_DB_PATH
+from result_store import get_result_store, RESULT_TTL_HOURS
+from metrics import get_metrics
+
+
+# Email configuration (use environment variables for security)
+SMTP_SERVER = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_EMAIL = os.environ.get('SMTP_EMAIL', '')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+
+# STARTTLS + login, turn off for a local test server (python -m aiosmtpd -n)
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+
+# Persistent SMTP connections kept open by the delivery process (one sender thread each).
+# At least one: queued emails are only ever sent by the delivery process
+SMTP_CONNECTIONS = max(1, int(os.environ.get('SMTP_CONNECTIONS', '2')))
+
+# Messages a sender claims and sends over its connection in one go
+SMTP_BATCH_SIZE = int(os.environ.get('SMTP_BATCH_SIZE', '10'))
+
+# Connections idle for longer than this are closed (servers drop them anyway)
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', '60'))
+
+# Failed messages are retried after SMTP_RETRY_DELAY * 2^attempts seconds
+SMTP_MAX_ATTEMPTS = int(os.environ.get('SMTP_MAX_ATTEMPTS', '5'))
+SMTP_RETRY_DELAY = float(os.environ.get('SMTP_RETRY_DELAY', '10'))
+
+# Outbox rows live next to the jobs, attachments are spooled here until sent
+MAIL_DB_PATH = os.environ.get('MAIL_DB_PATH', JOB_DB_PATH)
+MAIL_SPOOL_DIR = os.environ.get('MAIL_SPOOL_DIR', os.path.join('data', 'outbox'))
+
+# Seconds an idle sender waits before checking the outbox again
+MAIL_POLL_INTERVAL = float(os.environ.get('MAIL_POLL_INTERVAL', '1'))
+
+# A message left 'sending' by a delivery process that died is requeued after this long
+MAIL_LEASE_SECONDS = int(os.environ.get('MAIL_LEASE_SECONDS', '300'))
+
+# Attachment bytes read and base64-encoded at a time (57 bytes make one 76 character line)
+ATTACHMENT_CHUNK = 57 * 1024
+
+MAIL_BODY = """Hello!
+
+Your mashup has been generated successfully. Please find the attached zip file containing your audio mashup.
+
+Thank you for using our Mashup service!
+
+Best regards,
+Mashup Team
+"""
+
+LINK_BODY = """Hello!
+
+Your mashup has been generated successfully. It is too large to attach, you can download it here:
+
+{link}
+
+The link is valid for {hours} hours.
+
+Thank you for using our Mashup service!
+
+Best regards,
+Mashup Team
+"""
+
+
+def check_config():
+    """Raise if email cannot be sent with the current configuration"""
+    if not SMTP_EMAIL or (SMTP_STARTTLS and not SMTP_PASSWORD):
+        raise Exception("Email configuration not set. Please set SMTP_EMAIL and SMTP_PASSWORD environment variables.")
+
+
+def message_chunks(to_email, zip_file=None, link=None):
+    """
+    Yield the result email as CRLF-terminated bytes: multipart with the zip
+    attached, or plain text with the download link.
+
+    The attachment is read and base64-encoded ATTACHMENT_CHUNK bytes at a
+    time, so the message is never held in memory as a whole. Base64 and the
+    fixed bodies never start a line with '.', so no dot-stuffing is needed.
+    """
+    if link:
+        body = LINK_BODY.format(link=link, hours=int(RESULT_TTL_HOURS)).replace('\n', '\r\n')
+        yield (
+            f"Content-Type: text/plain; charset=\"us-ascii\"\r\n"
+            f"Content-Transfer-Encoding: 7bit\r\n"
+            f"MIME-Version: 1.0\r\n"
+            f"From: {SMTP_EMAIL}\r\n"
+            f"To: {to_email}\r\n"
+            f"Subject: Mashup Result\r\n"
+            f"Date: {formatdate(localtime=True)}\r\n"
+            f"Message-ID: {make_msgid()}\r\n"
+            f"\r\n"
+            f"{body}"
+        ).encode()
+        return
+
+    boundary = f"==============={uuid.uuid4().hex}=="
+    body = MAIL_BODY.replace('\n', '\r\n')
+    head = (
+        f"Content-Type: multipart/mixed; boundary=\"{boundary}\"\r\n"
+        f"MIME-Version: 1.0\r\n"
+        f"From: {SMTP_EMAIL}\r\n"
+        f"To: {to_email}\r\n"
+        f"Subject: Mashup Result\r\n"
+        f"Date: {formatdate(localtime=True)}\r\n"
+        f"Message-ID: {make_msgid()}\r\n"
+        f"\r\n"
+        f"--{boundary}\r\n"
+        f"Content-Type: text/plain; charset=\"us-ascii\"\r\n"
+        f"Content-Transfer-Encoding: 7bit\r\n"
+        f"\r\n"
+        f"{body}\r\n"
+        f"--{boundary}\r\n"
+        f"Content-Type: application/zip\r\n"
+        f"Content-Transfer-Encoding: base64\r\n"
+        f"Content-Disposition: attachment; filename={os.path.basename(zip_file)}\r\n"
+        f"\r\n"
+    )
+    yield head.encode()
+    with open(zip_file, 'rb') as attachment:
+        while True:
+            data = attachment.read(ATTACHMENT_CHUNK)
+            if not data:
+                break
+            yield base64.encodebytes(data).replace(b'\n', b'\r\n')
+    yield f"--{boundary}--\r\n".encode()
+
+
+class Outbox:
+    """
+    Outbound messages in SQLite (WAL mode), one row per recipient.
+
+    Mashup workers add messages and move on; the delivery process claims
+    due messages in batches, sends them and records the outcome. Failed
+    messages are retried with exponential backoff.
+    """
+
+    def __init__(self, db_path=None, spool_dir=None):
+        self.db_path = db_path or MAIL_DB_PATH
+        self.spool_dir = spool_dir or MAIL_SPOOL_DIR
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT, email TEXT, attachment TEXT,
+                status TEXT, attempts INTEGER DEFAULT 0, error TEXT,
+                created REAL, next_attempt REAL, claimed REAL, sent REAL, send_ms REAL, link TEXT)''')
+            columns = [row[1] for row in db.execute('PRAGMA table_info(outbox)')]
+            if 'link' not in columns:
+                db.execute('ALTER TABLE outbox ADD COLUMN link TEXT')
+            db.execute('CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)')
+            db.execute('CREATE INDEX IF NOT EXISTS outbox_job ON outbox (job_id)')
+            if not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'outbox_job_email'").fetchone():
+                # Older outboxes may hold repeats from a job that was run twice
+                db.execute('DELETE FROM outbox WHERE id NOT IN '
+                           '(SELECT MIN(id) FROM outbox GROUP BY job_id, email)')
+                db.execute('CREATE UNIQUE INDEX outbox_job_email ON outbox (job_id, email)')
+
+    def _connect(self):
+        """One connection per thread (sqlite connections are not shared)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def add(self, job_id, recipients, zip_file=None, link=None):
+        """
+        Queue one message per recipient, with zip_file attached (spooled until
+        sent) or with a download link. Returns the number queued.
+
+        Recipients that already have a message for job_id are skipped, so a
+        job run again after its worker died (between queueing the emails and
+        being marked done) does not email anyone twice.
+        """
+        attachment = None
+        if zip_file:
+            attachment = os.path.join(self.spool_dir, f"{job_id}.zip")
+            shutil.copyfile(zip_file, attachment)
+        now = time.time()
+        db = self._connect()
+        with db:
+            queued = db.executemany("INSERT OR IGNORE INTO outbox "
+                                    "(job_id, email, attachment, link, status, created, next_attempt) "
+                                    "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                                    [(job_id, email, attachment, link, now, now)
+                                     for email in recipients]).rowcount
+        # The copy is not needed if every recipient was emailed already
+        self._release(attachment)
+        return queued
+
+    def claim(self, limit=None):
+        """Mark up to limit due messages as sending and return them"""
+        db = self._connect()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            rows = db.execute("SELECT * FROM outbox WHERE status = 'queued' AND next_attempt <= ? "
+                              "ORDER BY next_attempt LIMIT ?",
+                              (time.time(), limit or SMTP_BATCH_SIZE)).fetchall()
+            db.executemany("UPDATE outbox SET status = 'sending', claimed = ?, attempts = attempts + 1 "
+                           "WHERE id = ?", [(time.time(), row['id']) for row in rows])
+        return [dict(row) for row in rows]
+
+    def sent(self, message, send_ms):
+        with self._connect() as db:
+            db.execute("UPDATE outbox SET status = 'sent', sent = ?, send_ms = ?, error = NULL "
+                       "WHERE id = ?", (time.time(), send_ms, message['id']))
+        self._release(message['attachment'])
+
+    def failed(self, message, error, permanent=False):
+        """Schedule a retry, or give up after SMTP_MAX_ATTEMPTS (or a permanent error)"""
+        attempts = SMTP_MAX_ATTEMPTS if permanent else message['attempts'] + 1
+        with self._connect() as db:
+            if attempts >= SMTP_MAX_ATTEMPTS:
+                db.execute("UPDATE outbox SET status = 'failed', error = ? WHERE id = ?",
+                           (str(error), message['id']))
+            else:
+                db.execute("UPDATE outbox SET status = 'queued', error = ?, next_attempt = ? WHERE id = ?",
+                           (str(error), time.time() + SMTP_RETRY_DELAY * 2 ** (attempts - 1),
+                            message['id']))
+        if attempts >= SMTP_MAX_ATTEMPTS:
+            self._release(message['attachment'])
+
+    def _release(self, attachment):
+        """Delete a spooled attachment once no message still needs it"""
+        if not attachment:
+            return
+        waiting = self._connect().execute("SELECT COUNT(*) FROM outbox WHERE attachment = ? "
+                                          "AND status IN ('queued', 'sending')",
+                                          (attachment,)).fetchone()[0]
+        if not waiting:
+            try:
+                os.remove(attachment)
+            except FileNotFoundError:
+                pass
+
+    def recover(self, lease_seconds=None):
+        """Requeue messages left 'sending' by a delivery process that died"""
+        cutoff = time.time() - (MAIL_LEASE_SECONDS if lease_seconds is None else lease_seconds)
+        with self._connect() as db:
+            return db.execute("UPDATE outbox SET status = 'queued', next_attempt = ? "
+                              "WHERE status = 'sending' AND claimed < ?", (time.time(), cutoff)).rowcount
+
+    def job_deliveries(self, job_id):
+        """Number of messages per status for one job"""
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM outbox WHERE job_id = ? '
+                                       'GROUP BY status', (job_id,)).fetchall()
+        return {status: count for status, count in rows}
+
+    def stats(self):
+        """Queue depth, outcomes and send latency of recent messages"""
+        db = self._connect()
+        counts = dict(db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+        recent = db.execute("SELECT send_ms, sent - created FROM outbox WHERE status = 'sent' "
+                            "ORDER BY sent DESC LIMIT 100").fetchall()
+        send_ms = sorted(row[0] for row in recent)
+        delivery = sorted(row[1] for row in recent)
+        return {
+            'queue_depth': counts.get('queued', 0) + counts.get('sending', 0),
+            'sent': counts.get('sent', 0),
+            'failed': counts.get('failed', 0),
+            'send_ms_avg': round(sum(send_ms) / len(send_ms), 1) if send_ms else None,
+            'send_ms_p95': round(send_ms[int(len(send_ms) * 0.95)], 1) if send_ms else None,
+            'delivery_seconds_p95': round(delivery[int(len(delivery) * 0.95)], 1) if delivery else None,
+        }
+
+
+class SMTPConnection:
+    """
+    A persistent, logged-in SMTP connection.
+
+    The connection is opened on first use, checked with NOOP after being
+    idle, reopened when the server dropped it and closed after
+    SMTP_IDLE_TIMEOUT without messages.
+    """
+
+    def __init__(self, server=None, port=None, smtp_class=smtplib.SMTP):
+        self.server = server or SMTP_SERVER
+        self.port = port or SMTP_PORT
+        self.smtp_class = smtp_class
+        self.smtp = None
+        self.last_used = 0
+        self.connects = 0
+
+    def _open(self):
+        self.smtp = self.smtp_class(self.server, self.port, timeout=30)
+        if SMTP_STARTTLS:
+            self.smtp.starttls()
+            self.smtp.login(SMTP_EMAIL, SMTP_PASSWORD)
+        self.connects += 1
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+    def close_if_idle(self):
+        if self.smtp is not None and time.time() - self.last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def _ensure(self):
+        if self.smtp is not None and time.time() - self.last_used > 5:
+            try:
+                if self.smtp.noop()[0] != 250:
+                    self.close()
+            except (smtplib.SMTPException, OSError):
+                self.smtp = None
+        if self.smtp is None:
+            self._open()
+
+    def _send(self, to_email, zip_file, link):
+        """MAIL/RCPT/DATA by hand so the message can be written to the socket in chunks"""
+        smtp = self.smtp
+        smtp.ehlo_or_helo_if_needed()
+        code, reply = smtp.mail(SMTP_EMAIL)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, reply, SMTP_EMAIL)
+        code, reply = smtp.rcpt(to_email)
+        if code not in (250, 251):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused({to_email: (code, reply)})
+        smtp.putcmd('data')
+        code, reply = smtp.getreply()
+        if code != 354:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, reply)
+        for chunk in message_chunks(to_email, zip_file, link):
+            smtp.sock.sendall(chunk)
+        smtp.sock.sendall(b'.\r\n')
+        code, reply = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+
+    def send(self, to_email, zip_file=None, link=None):
+        """Send the result email, reconnecting once if the server closed the connection"""
+        self._ensure()
+        try:
+            self._send(to_email, zip_file, link)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.smtp = None
+            self._open()
+            self._send(to_email, zip_file, link)
+        self.last_used = time.time()
+
+
+def send_batch(outbox, connection, messages):
+    """Send claimed messages over one connection and record each outcome"""
+    for message in messages:
+        start = time.time()
+        try:
+            connection.send(message['email'], message['attachment'], message['link'])
+        except Exception as e:
+            print(f"✗ Email to {message['email']} failed (attempt {message['attempts'] + 1}): {str(e)}")
+            # A 5xx answer or refused recipient will not get better by retrying
+            permanent = (isinstance(e, smtplib.SMTPRecipientsRefused) or
+                         (isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500))
+            if not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                # The connection state is unknown, start the next message on a new one
+                connection.close()
+            outbox.failed(message, e, permanent)
+            get_metrics().inc('mashup_emails_total', status='error')
+            continue
+        elapsed = time.time() - start
+        outbox.sent(message, elapsed * 1000)
+        get_metrics().observe('mashup_email_send_seconds', elapsed)
+        get_metrics().inc('mashup_emails_total', status='sent')
+        print(f"📧 Sent mashup of job {message['job_id']} to {message['email']}")
+
+
+def sender_loop(outbox, connection, stop):
+    """Claim and send batches until stop is set (one thread of the delivery process)"""
+    while not stop.is_set():
+        messages = outbox.claim()
+        if messages:
+            send_batch(outbox, connection, messages)
+            continue
+        connection.close_if_idle()
+        stop.wait(MAIL_POLL_INTERVAL)
+    connection.close()
+
+
+def delivery_loop(stop=None):
+    """Run SMTP_CONNECTIONS sender threads forever (the delivery process)"""
+    outbox = Outbox()
+    stop = stop or threading.Event()
+    threads = [threading.Thread(target=sender_loop, args=(outbox, SMTPConnection(), stop), daemon=True)
+               for _ in range(SMTP_CONNECTIONS)]
+    for thread in threads:
+        thread.start()
+    while not stop.wait(MAIL_POLL_INTERVAL * 30):
+        requeued = outbox.recover()
+        if requeued:
+            print(f"♻️  Requeued {requeued} interrupted emails")
+        expired = get_result_store().evict()
+        if expired:
+            print(f"🧹 Removed {expired} expired download results")
+    for thread in threads:
+        thread.join()
+
+
+_outbox = None
+
+
+def get_outbox():
+    """The outbox of this process (opened on first use)"""
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox()
+    return _outbox
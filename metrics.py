@@ -0,0 +1,209 @@
+"""
+Mashup Assignment - Metrics
+Counters and histograms shared by every web and worker process, exported in Prometheus format
+"""
+
+import os
+import math
+import sqlite3
+import threading
+
+
+METRICS_DB_PATH = os.environ.get('METRICS_DB_PATH', os.path.join('data', 'metrics.sqlite3'))
+
+# Upper bounds (seconds) of the latency histogram buckets
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+EMAIL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'mashup_stage_seconds': ('histogram', 'Time spent in each pipeline stage', STAGE_BUCKETS),
+    'mashup_job_seconds': ('histogram', 'Time from a job starting to finishing', STAGE_BUCKETS),
+    'mashup_jobs_total': ('counter', 'Jobs finished, by status', None),
+    'mashup_job_failures_total': ('counter', 'Failed jobs, by the stage they failed in', None),
+    'mashup_downloaded_bytes_total': ('counter', 'Bytes of source audio downloaded', None),
+    'mashup_encoded_bytes_total': ('counter', 'Bytes of mashup audio encoded', None),
+    'mashup_email_send_seconds': ('histogram', 'Time to send one email over SMTP', EMAIL_BUCKETS),
+    'mashup_emails_total': ('counter', 'Emails handled by the delivery process, by outcome', None),
+}
+
+
+def _labels(labels):
+    """Canonical label string: key="value",... sorted by key"""
+    return ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metrics:
+    """
+    Counters and histograms stored in SQLite (WAL mode).
+
+    Every gunicorn worker, job worker and the delivery process write to the
+    same database, so a scrape of any web worker sees the totals of all of
+    them. Histogram buckets are stored cumulatively, as Prometheus expects.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or METRICS_DB_PATH
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS samples (
+                name TEXT, labels TEXT, value REAL, PRIMARY KEY (name, labels))''')
+            db.execute('''CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT, labels TEXT, le REAL, count INTEGER, PRIMARY KEY (name, labels, le))''')
+
+    def _connect(self):
+        """One connection per thread (sqlite connections are not shared)"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            self._local.db = db
+        return db
+
+    def _add(self, db, name, labels, amount):
+        db.execute('INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) '
+                   'ON CONFLICT(name, labels) DO UPDATE SET value = value + ?',
+                   (name, labels, amount, amount))
+
+    def inc(self, name, amount=1, **labels):
+        with self._connect() as db:
+            self._add(db, name, _labels(labels), amount)
+
+    def observe(self, name, value, **labels):
+        """Record one value in histogram name"""
+        labels = _labels(labels)
+        with self._connect() as db:
+            for le in METRICS[name][2] + (math.inf,):
+                if value <= le:
+                    db.execute('INSERT INTO buckets (name, labels, le, count) VALUES (?, ?, ?, 1) '
+                               'ON CONFLICT(name, labels, le) DO UPDATE SET count = count + 1',
+                               (name, labels, le))
+            self._add(db, f"{name}_sum", labels, value)
+            self._add(db, f"{name}_count", labels, 1)
+
+    def render(self, gauges=None):
+        """
+        All metrics in the Prometheus text format. gauges is a list of
+        (name, help, [(labels dict, value)]) computed by the caller at scrape time.
+        """
+        db = self._connect()
+        samples = {}
+        for name, labels, value in db.execute('SELECT name, labels, value FROM samples ORDER BY name, labels'):
+            samples.setdefault(name, []).append((labels, value))
+        buckets = {}
+        for name, labels, le, count in db.execute(
+                'SELECT name, labels, le, count FROM buckets ORDER BY name, labels, le'):
+            buckets.setdefault((name, labels), []).append((le, count))
+
+        lines = []
+        for name, (kind, help_text, bounds) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for labels, value in samples.get(name, []):
+                    lines.append(f"{name}{{{labels}}} {_format(value)}" if labels else f"{name} {_format(value)}")
+                continue
+            for labels, total in samples.get(f"{name}_count", []):
+                counts = dict(buckets.get((name, labels), []))
+                for le in bounds + (math.inf,):
+                    bucket_labels = f'{labels},le="{_format(le)}"' if labels else f'le="{_format(le)}"'
+                    lines.append(f"{name}_bucket{{{bucket_labels}}} {counts.get(le, 0)}")
+                value = dict(samples.get(f"{name}_sum", [])).get(labels, 0)
+                suffix = f"{{{labels}}}" if labels else ''
+                lines.append(f"{name}_sum{suffix} {_format(value)}")
+                lines.append(f"{name}_count{suffix} {_format(total)}")
+
+        for name, help_text, values in gauges or []:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in values:
+                labels = _labels(labels)
+                lines.append(f"{name}{{{labels}}} {_format(value)}" if labels else f"{name} {_format(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def update_stages(stages, stage, done, total, now):
+    """
+    Apply one progress(stage, done, total) call to a list of stage records
+    ({'name', 'started', 'finished', 'done', 'total'}), returns the records
+    it finished.
+
+    A new stage ends the ones before it, except counted stages still short of
+    their total when the new stage is counted too (trims overlapping the
+    downloads). A counted stage also ends once done reaches total. A stage
+    reported again is updated in place.
+    """
+    finished = []
+    entry = next((entry for entry in stages if entry['name'] == stage), None)
+    if entry is None:
+        for previous in stages:
+            counting = total and previous.get('total') and (previous.get('done') or 0) < previous['total']
+            if previous['finished'] is None and not counting:
+                previous['finished'] = now
+                finished.append(previous)
+        entry = {'name': stage, 'started': now, 'finished': None}
+        stages.append(entry)
+    entry['done'] = done
+    entry['total'] = total
+    if entry['finished'] is None and total and done is not None and done >= total:
+        entry['finished'] = now
+        finished.append(entry)
+    return finished
+
+
+class StageTimer:
+    """
+    Turns progress(stage, done, total) calls into stage latency observations.
+
+    Stages start and end as in update_stages(), the ones still running end
+    when finish() is called with the job's outcome (a failure is counted
+    against the newest stage). Safe to call from several threads.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.stages = []
+        self.job_started = None
+        self._lock = threading.Lock()
+
+    def _observe(self, entry):
+        self.metrics.observe('mashup_stage_seconds', entry['finished'] - entry['started'],
+                             stage=entry['name'])
+
+    def progress(self, stage, now, done=None, total=None):
+        with self._lock:
+            if self.job_started is None:
+                self.job_started = now
+            for entry in update_stages(self.stages, stage, done, total, now):
+                self._observe(entry)
+
+    def finish(self, status, now):
+        with self._lock:
+            for entry in self.stages:
+                if entry['finished'] is None:
+                    entry['finished'] = now
+                    self._observe(entry)
+        if self.job_started is not None:
+            self.metrics.observe('mashup_job_seconds', now - self.job_started)
+        self.metrics.inc('mashup_jobs_total', status=status)
+        if status == 'failed':
+            self.metrics.inc('mashup_job_failures_total',
+                             stage=self.stages[-1]['name'] if self.stages else 'start')
+
+
+_metrics = None
+
+
+def get_metrics():
+    """The metrics store of this process (opened on first use)"""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
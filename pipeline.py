@@ -0,0 +1,283 @@
+"""
+Mashup Assignment - Pipeline
+Search, download, trim, merge and email steps of a mashup job (run by the job workers)
+"""
+
+import os
+import shutil
+import zipfile
+import uuid
+from yt_dlp import YoutubeDL
+from pydub import AudioSegment
+from downloader import build_ydl_opts, search_videos, search_count, filter_entries, download_first, HEAD_ONLY_DOWNLOADS
+from audio_cache import get_source_cache, get_trim_cache, get_search_cache
+from audio_merge import stream_merge, pcm_merge, ffmpeg_mashup, probe_ffmpeg, MERGE_ENGINE, PIPELINE_BACKEND, FFMPEG_LOCATION
+from trimming import TrimStage, TRIM_ENGINE, OVERLAP_STAGES
+from workspace import Workspace
+from result_store import get_result_store, DOWNLOAD_LINK_THRESHOLD_MB
+from metrics import get_metrics
+from profiling import start_profiler
+from mailer import get_outbox, check_config
+
+
+# ffmpeg/ffprobe found once per deployment (see probe_ffmpeg), not by every process
+FFMPEG = probe_ffmpeg()
+AudioSegment.converter = FFMPEG['ffmpeg']
+AudioSegment.ffmpeg = FFMPEG['ffmpeg']
+AudioSegment.ffprobe = FFMPEG['ffprobe']
+
+
+def no_progress(stage, done=None, total=None):
+    """Default progress callback of the pipeline steps (does nothing)"""
+
+
+def count_download(file_path):
+    """Count the bytes of a download fetched from the network (cache hits are not counted)"""
+    get_metrics().inc('mashup_downloaded_bytes_total', os.path.getsize(file_path))
+
+
+def download_videos(singer_name, num_videos, duration=None, max_workers=None, ydl_class=YoutubeDL,
+                    extract_audio=True, output_dir='downloads', progress=no_progress, on_download=None):
+    """
+    Download YouTube videos (only the first `duration` seconds in head-only mode).
+
+    on_download(file_path) is called as soon as each download lands.
+    """
+    head_seconds = duration if HEAD_ONLY_DOWNLOADS else None
+    ydl_opts = build_ydl_opts(output_dir, quiet=True, ffmpeg_location=FFMPEG_LOCATION,
+                              head_seconds=head_seconds, extract_audio=extract_audio)
+    
+    # Over-fetch candidates, then drop live streams, shorts, compilations etc.
+    progress('search')
+    candidates = search_videos(singer_name, search_count(num_videos), ydl_opts,
+                               ydl_class=ydl_class, cache=get_search_cache())
+    entries, rejected = filter_entries(candidates, duration)
+    for entry, reason in rejected:
+        print(f"  ⏭️  Skipped {entry['title']} ({reason})")
+    
+    downloaded = []
+    progress('download', 0, num_videos)
+    
+    def report(index, entry, file_path, error):
+        if error:
+            print(f"  ✗ {entry['title']}: {str(error)}")
+        else:
+            downloaded.append(file_path)
+            progress('download', len(downloaded), num_videos)
+            print(f"  ✓ [{len(downloaded)}/{num_videos}] Downloaded: {entry['title']}")
+            if on_download:
+                on_download(file_path)
+    
+    return download_first(entries, num_videos, ydl_opts, on_result=report,
+                          max_workers=max_workers, ydl_class=ydl_class,
+                          cache=get_source_cache(), head_seconds=head_seconds,
+                          clip_seconds=duration, on_fetch=count_download)
+
+
+def process_audio(downloaded_files, audios_dir='audios'):
+    """Copy audio files to audios folder"""
+    audio_files = []
+    for file_path in downloaded_files:
+        filename = os.path.basename(file_path)
+        audio_path = os.path.join(audios_dir, filename)
+        shutil.copy(file_path, audio_path)
+        audio_files.append(audio_path)
+    return audio_files
+
+
+def trim_audio(audio_files, duration, engine=None, trimmed_dir='trimmed', progress=no_progress, workers=None):
+    """
+    Trim first Y seconds from each audio (engine: 'pydub' or 'frames').
+
+    Files are trimmed on `workers` processes (TRIM_WORKERS by default), the
+    result keeps the order of audio_files and files that fail are skipped.
+    """
+    engine = engine or TRIM_ENGINE
+    
+    done = []
+    progress('trim', 0, len(audio_files))
+    
+    def report(audio_path, trimmed_path, reused, error):
+        done.append(audio_path)
+        report_trim(audio_path, trimmed_path, reused, error)
+        progress('trim', len(done), len(audio_files))
+    
+    # Reuses clips trimmed by an earlier job (same video, duration, settings)
+    stage = TrimStage(duration, engine, trimmed_dir, cache=get_trim_cache(), workers=workers,
+                      on_trim=report)
+    try:
+        for audio_path in audio_files:
+            stage.submit(audio_path)
+    finally:
+        stage.finish()
+    return stage.results(audio_files)
+
+
+def report_trim(audio_path, trimmed_path, reused, error):
+    """Log one trimmed file"""
+    if error:
+        print(f"  ✗ Trim failed: {os.path.basename(audio_path)}: {str(error)}")
+    else:
+        print(f"  ✂️  {'Reused cached clip' if reused else 'Trimmed'}: {os.path.basename(audio_path)}")
+
+
+def merge_audios(trimmed_files, output_file, engine=None, duration=None):
+    """Merge all audio files (engine: 'stream', 'numpy' or 'pydub', numpy needs the clip duration)"""
+    engine = engine or MERGE_ENGINE
+    if engine == 'stream':
+        # Clips are streamed through one encoder, memory stays flat
+        stream_merge(trimmed_files, output_file, ffmpeg=AudioSegment.converter)
+        return
+    if engine == 'numpy':
+        # Clips are decoded into one preallocated buffer and encoded once
+        if not duration:
+            raise Exception("The numpy merge engine needs the clip duration")
+        pcm_merge(trimmed_files, output_file, duration, ffmpeg=AudioSegment.converter)
+        return
+    
+    combined = AudioSegment.empty()
+    
+    for trimmed_path in trimmed_files:
+        audio = AudioSegment.from_mp3(trimmed_path)
+        combined += audio
+    
+    combined.export(output_file, format='mp3')
+
+
+def create_zip(mp3_file, zip_file):
+    """Create zip file containing the mp3"""
+    # MP3 is already compressed, DEFLATE would only burn CPU
+    compression = zipfile.ZIP_STORED if mp3_file.lower().endswith('.mp3') else zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(zip_file, 'w', compression) as zipf:
+        zipf.write(mp3_file, os.path.basename(mp3_file))
+
+
+def process_mashup(singer_name, num_videos, duration, email, progress=no_progress, get_recipients=None,
+                   job_id=None):
+    """
+    Process mashup (run by the job workers, raises on failure).
+
+    progress(stage, done, total) is called as the job moves through the
+    search, download, trim, merge, zip and email stages. get_recipients()
+    returns every address the result goes to (requests coalesced into this
+    job), it is called once the email stage has started. The emails are
+    queued in the outbox and sent by the delivery process.
+    
+    A PROFILE_SAMPLE_RATE fraction of jobs is profiled (see profiling.py).
+    """
+    workspace = None
+    job_id = job_id or uuid.uuid4().hex
+    profiler = start_profiler(job_id)
+    # Subprocesses are only timed in the job process, so a profiled job trims in it
+    trim_workers = None
+    if profiler:
+        progress = profiler.progress(progress)
+        trim_workers = 1
+    try:
+        print(f"🎵 Starting mashup for {singer_name}...")
+        
+        # Private scratch directories, so concurrent jobs never touch each other's files
+        workspace = Workspace()
+        print(f"✓ Created workspace {workspace.path}")
+        
+        # Download videos
+        print(f"⬇️  Downloading {num_videos} videos...")
+        single_pass = PIPELINE_BACKEND == 'ffmpeg'
+        trim_stage = None
+        if OVERLAP_STAGES and not single_pass:
+            # Trim each file as soon as it lands, while the other downloads continue
+            trims = []
+            
+            def on_trim(audio_path, trimmed_path, reused, error):
+                report_trim(audio_path, trimmed_path, reused, error)
+                trims.append(audio_path)
+                progress('trim', len(trims), num_videos)
+            
+            trim_stage = TrimStage(duration, TRIM_ENGINE, workspace.trimmed, cache=get_trim_cache(),
+                                   workers=trim_workers, on_trim=on_trim)
+        try:
+            downloaded_files = download_videos(singer_name, num_videos, duration,
+                                               extract_audio=not single_pass,
+                                               output_dir=workspace.downloads, progress=progress,
+                                               on_download=trim_stage.submit if trim_stage else None)
+        finally:
+            if trim_stage:
+                trim_stage.finish()
+        print(f"✓ Downloaded {len(downloaded_files)} videos")
+        
+        if len(downloaded_files) == 0:
+            raise Exception("No videos were downloaded")
+        
+        output_mp3 = os.path.join(workspace.output, 'mashup.mp3')
+        
+        if single_pass:
+            # Trim + merge + encode in one ffmpeg run, straight from the downloads
+            print(f"🎛️  Building mashup from the first {duration} seconds in one ffmpeg pass...")
+            progress('merge')
+            used_files = ffmpeg_mashup(downloaded_files, duration, output_mp3,
+                                       ffmpeg=AudioSegment.converter)
+            print(f"✓ Merged {len(used_files)} audio files")
+        else:
+            if trim_stage:
+                # Already trimmed while downloading, straight from the downloads
+                trimmed_files = trim_stage.results(downloaded_files)
+                progress('trim', len(trimmed_files), len(downloaded_files))
+            else:
+                # Process audio
+                print("🎧 Processing audio files...")
+                audio_files = process_audio(downloaded_files, workspace.audios)
+                print(f"✓ Processed {len(audio_files)} audio files")
+                
+                # Trim audio
+                print(f"✂️  Trimming first {duration} seconds...")
+                trimmed_files = trim_audio(audio_files, duration, trimmed_dir=workspace.trimmed,
+                                           progress=progress, workers=trim_workers)
+            print(f"✓ Trimmed {len(trimmed_files)} audio files")
+            
+            if len(trimmed_files) == 0:
+                raise Exception("No audio files were trimmed")
+            
+            # Merge audios
+            print("🔗 Merging audio files...")
+            progress('merge')
+            merge_audios(trimmed_files, output_mp3, duration=duration)
+            print("✓ Merged audio files")
+        
+        get_metrics().inc('mashup_encoded_bytes_total', os.path.getsize(output_mp3))
+        size_mb = os.path.getsize(output_mp3) / 1024 / 1024
+        if size_mb > DOWNLOAD_LINK_THRESHOLD_MB:
+            # Too large to attach, keep it in the result store and email a link
+            print(f"🔗 Mashup is {size_mb:.1f} MB, sending a download link...")
+            link = get_result_store().put(job_id, output_mp3)
+            output_zip = None
+        else:
+            # Create zip
+            print("📦 Creating zip file...")
+            progress('zip')
+            output_zip = os.path.join(workspace.output, 'mashup.zip')
+            create_zip(output_mp3, output_zip)
+            print("✓ Created zip file")
+            link = None
+        
+        # Queue the emails, the delivery process sends them
+        progress('email')
+        check_config()
+        recipients = get_recipients() if get_recipients else [email]
+        # Recipients already queued by an interrupted earlier attempt are skipped
+        queued = get_outbox().add(job_id, recipients, output_zip, link)
+        print(f"📧 Queued email to {queued} recipient(s)")
+        
+        print("✅ Mashup process completed successfully!")
+        
+    except Exception as e:
+        print(f"❌ Error in mashup process: {str(e)}")
+        raise
+    
+    finally:
+        # Cleanup
+        if workspace:
+            print("🧹 Cleaning up...")
+            workspace.cleanup()
+            print("✓ Cleanup completed")
+        if profiler:
+            profiler.stop()
@@ -0,0 +1,207 @@
+"""
+Mashup Assignment - Profiling
+Opt-in per-job profiles (cProfile, tracemalloc per stage, subprocess wall times)
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import pstats
+import cProfile
+import threading
+import subprocess
+import tracemalloc
+
+
+# Fraction of jobs profiled (0 disables profiling, 1 profiles every job)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+
+# Every profiled job writes its bundle to PROFILE_DIR/<job_id>/
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join('data', 'profiles'))
+
+# Allocation sites kept per stage
+PROFILE_TOP_ALLOCATIONS = int(os.environ.get('PROFILE_TOP_ALLOCATIONS', '15'))
+
+
+class JobProfiler:
+    """
+    Profiles one job from start() to stop() and writes the results to
+    root/<name>/:
+
+    - profile.pstats / profile.txt: cProfile of the job's thread and of the
+      threads it starts (download pool, trim workers)
+    - allocations.json: per stage, the peak and net traced memory and the
+      source lines that allocated the most during it (tracemalloc)
+    - subprocesses.json: wall time of every subprocess (ffmpeg, ffprobe, ...)
+      with the stage it ran in
+    - summary.json: stage wall times and totals
+
+    Only one job per process should be profiled at a time, the subprocess
+    and thread hooks are process-wide.
+    """
+
+    def __init__(self, name, root=None):
+        self.name = name
+        self.path = os.path.join(root or PROFILE_DIR, name)
+        self.stage = None
+        self.stages = []
+        self.allocations = []
+        self.subprocesses = []
+        self._lock = threading.Lock()
+        self._stage_lock = threading.Lock()
+        self._profile = cProfile.Profile()
+        self._thread_profiles = []
+        self._snapshot = None
+        self._started = None
+        self._popen_init = None
+        self._popen_wait = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._hook_subprocesses()
+        tracemalloc.start()
+        self._snapshot = self._take_snapshot()
+        if sys.version_info < (3, 12):
+            # cProfile only sees the thread that enabled it before 3.12 (sys.monitoring)
+            threading.setprofile(self._profile_thread)
+        self._profile.enable()
+        return self
+
+    def _profile_thread(self, frame, event, arg):
+        """First profile event of a new thread: give the thread its own profiler"""
+        profile = cProfile.Profile()
+        with self._lock:
+            self._thread_profiles.append(profile)
+        profile.enable()
+
+    def _hook_subprocesses(self):
+        """Time every Popen from creation until wait() sees it exit"""
+        profiler = self
+        popen_init = self._popen_init = subprocess.Popen.__init__
+        popen_wait = self._popen_wait = subprocess.Popen.wait
+
+        def init(popen, args, *rest, **kwargs):
+            popen._profile_started = time.perf_counter()
+            popen._profile_stage = profiler.stage
+            popen_init(popen, args, *rest, **kwargs)
+
+        def wait(popen, timeout=None):
+            returncode = popen_wait(popen, timeout)
+            started = getattr(popen, '_profile_started', None)
+            if started is not None:
+                popen._profile_started = None
+                args = popen.args if isinstance(popen.args, (list, tuple)) else [popen.args]
+                with profiler._lock:
+                    profiler.subprocesses.append({
+                        'program': os.path.basename(str(args[0])) if args else '',
+                        'args': [str(arg) for arg in args],
+                        'stage': popen._profile_stage,
+                        'seconds': round(time.perf_counter() - started, 4),
+                        'returncode': returncode,
+                    })
+            return returncode
+
+        subprocess.Popen.__init__ = init
+        subprocess.Popen.wait = wait
+
+    def _take_snapshot(self):
+        # Leave out tracemalloc's own bookkeeping (previous snapshots)
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def _close_stage(self, now):
+        if self.stage is None:
+            return
+        snapshot = self._take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        top = snapshot.compare_to(self._snapshot, 'lineno')[:PROFILE_TOP_ALLOCATIONS]
+        self.allocations.append({
+            'stage': self.stage,
+            'peak_bytes': peak,
+            'net_bytes': current - self.stages[-1]['traced_bytes'],
+            'top': [{'line': str(stat.traceback[0]), 'size_diff': stat.size_diff,
+                     'count_diff': stat.count_diff, 'size': stat.size} for stat in top],
+        })
+        self.stages[-1]['seconds'] = round(now - self.stages[-1]['started'], 3)
+        self._snapshot = snapshot
+
+    def set_stage(self, stage):
+        """
+        Start a new stage. Calls for a stage that already started are ignored,
+        so overlapping stages (trims reported while downloads still run) are
+        profiled as one stage after the other.
+        """
+        with self._stage_lock:
+            if any(entry['name'] == stage for entry in self.stages):
+                return
+            now = time.perf_counter()
+            self._close_stage(now)
+            tracemalloc.reset_peak()
+            self.stage = stage
+            self.stages.append({'name': stage, 'started': now, 'seconds': None,
+                                'traced_bytes': tracemalloc.get_traced_memory()[0]})
+
+    def progress(self, progress):
+        """Wrap a progress(stage, done, total) callback so it also marks stages"""
+        def wrapped(stage, done=None, total=None):
+            self.set_stage(stage)
+            progress(stage, done, total)
+        return wrapped
+
+    def stop(self):
+        """Stop profiling and write the bundle, returns its directory"""
+        self._profile.disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        now = time.perf_counter()
+        self._close_stage(now)
+        tracemalloc.stop()
+        subprocess.Popen.__init__ = self._popen_init
+        subprocess.Popen.wait = self._popen_wait
+
+        os.makedirs(self.path, exist_ok=True)
+        stats = pstats.Stats(self._profile)
+        for profile in self._thread_profiles:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # A thread that never returned from its first call has no stats
+                pass
+        stats.dump_stats(os.path.join(self.path, 'profile.pstats'))
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(60)
+        with open(os.path.join(self.path, 'profile.txt'), 'w') as f:
+            f.write(text.getvalue())
+
+        with open(os.path.join(self.path, 'allocations.json'), 'w') as f:
+            json.dump(self.allocations, f, indent=2)
+        with open(os.path.join(self.path, 'subprocesses.json'), 'w') as f:
+            json.dump(self.subprocesses, f, indent=2)
+
+        programs = {}
+        for call in self.subprocesses:
+            totals = programs.setdefault(call['program'], {'calls': 0, 'seconds': 0})
+            totals['calls'] += 1
+            totals['seconds'] = round(totals['seconds'] + call['seconds'], 3)
+        summary = {
+            'job': self.name,
+            'seconds': round(now - self._started, 3),
+            'stages': [{'name': stage['name'], 'seconds': stage['seconds']} for stage in self.stages],
+            'subprocesses': programs,
+            'threads_profiled': len(self._thread_profiles) + 1,
+        }
+        with open(os.path.join(self.path, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"🔬 Wrote profile of {self.name} to {self.path}")
+        return self.path
+
+
+def start_profiler(name, sample_rate=None):
+    """A started JobProfiler for a sampled job, None for the others (and when disabled)"""
+    rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or random.random() >= rate:
+        return None
+    return JobProfiler(name).start()
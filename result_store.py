@@ -0,0 +1,116 @@
+"""
+Mashup Assignment - Result Store
+Keeps finished mashups for a while so large results can be downloaded instead of emailed
+"""
+
+import os
+import hmac
+import time
+import shutil
+import hashlib
+import secrets
+
+
+RESULT_DIR = os.environ.get('RESULT_DIR', os.path.join('data', 'results'))
+
+# How long a download link (and the file behind it) stays valid
+RESULT_TTL_HOURS = float(os.environ.get('RESULT_TTL_HOURS', '72'))
+
+# Mashups larger than this are sent as a download link instead of an attachment
+# (providers reject ~25 MB emails and base64 adds a third)
+DOWNLOAD_LINK_THRESHOLD_MB = float(os.environ.get('DOWNLOAD_LINK_THRESHOLD_MB', '18'))
+
+# Where the web app is reachable from the recipient's browser
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', 'http://localhost:5000').rstrip('/')
+
+# Key used to sign download links, generated once and kept next to the results if unset
+RESULT_LINK_SECRET = os.environ.get('RESULT_LINK_SECRET', '')
+
+
+class ResultStore:
+    """
+    Finished mashups stored as root/<job_id>.mp3 for ttl seconds.
+
+    Links carry the expiry time and an HMAC of job id + expiry, so the web
+    app can check them without a database lookup.
+    """
+
+    def __init__(self, root=None, ttl=None, secret=None):
+        # Absolute, Flask's send_file resolves relative paths against the app directory
+        self.root = os.path.abspath(root or RESULT_DIR)
+        self.ttl = RESULT_TTL_HOURS * 3600 if ttl is None else ttl
+        os.makedirs(self.root, exist_ok=True)
+        self.secret = (secret or RESULT_LINK_SECRET or self._load_secret()).encode()
+
+    def _load_secret(self):
+        """Shared secret of every process using this store (created by the first one)"""
+        path = os.path.join(self.root, '.link_secret')
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(path) as f:
+                return f.read().strip()
+        secret = secrets.token_hex(32)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secret)
+        return secret
+
+    def path(self, job_id):
+        return os.path.join(self.root, f"{job_id}.mp3")
+
+    def put(self, job_id, file_path):
+        """Store file_path as job_id's result and return its signed download link"""
+        temp_path = self.path(job_id) + '.tmp'
+        shutil.copyfile(file_path, temp_path)
+        os.replace(temp_path, self.path(job_id))
+        return self.link(job_id, int(time.time() + self.ttl))
+
+    def sign(self, job_id, expires):
+        message = f"{job_id}:{expires}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def link(self, job_id, expires):
+        return f"{PUBLIC_BASE_URL}/download/{job_id}?expires={expires}&sig={self.sign(job_id, expires)}"
+
+    def open_link(self, job_id, expires, sig):
+        """
+        Path of job_id's result if the link is valid, raises PermissionError for
+        a bad signature and FileNotFoundError when the link or file expired.
+        """
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            raise PermissionError("Invalid download link")
+        if not hmac.compare_digest(self.sign(job_id, expires), sig or ''):
+            raise PermissionError("Invalid download link")
+        path = self.path(job_id)
+        if expires < time.time() or not os.path.exists(path):
+            raise FileNotFoundError("This download link has expired")
+        return path
+
+    def evict(self):
+        """Delete results older than the TTL, returns how many were removed"""
+        removed = 0
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.root):
+            if not name.endswith('.mp3'):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+_result_store = None
+
+
+def get_result_store():
+    """The result store of this process (opened on first use)"""
+    global _result_store
+    if _result_store is None:
+        _result_store = ResultStore()
+    return _result_store
@@ -0,0 +1,326 @@
+"""
+Tests for Mashup Assignment
+Run with: python -m pytest
+"""
+
+import os
+import shutil
+import resource
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+
+needs_ffmpeg = pytest.mark.skipif(not shutil.which('ffmpeg'), reason='ffmpeg not installed')
+
+# Peak RSS allowed for a scratch-mode merge, whatever the mashup length (as in benchmark.py)
+SCRATCH_RSS_CEILING_MB = 100
+
+
+def make_mp3(path, seconds, frequency=440):
+    """Encode a sine tone of `seconds` seconds to path"""
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi',
+                    '-i', f'sine=frequency={frequency}:duration={seconds}',
+                    '-ac', '2', '-ar', '44100', '-b:a', '128k', path], check=True)
+    return path
+
+
+def mp3_seconds(path):
+    """Decoded length of path (44.1 kHz stereo 16-bit PCM)"""
+    result = subprocess.run(['ffmpeg', '-loglevel', 'error', '-i', path, '-f', 's16le',
+                             '-ac', '2', '-ar', '44100', '-'], capture_output=True, check=True)
+    return len(result.stdout) / (44100 * 4)
+
+
+def _trim_in_daemon(audio_files, trimmed_dir):
+    from trimming import TrimStage
+    stage = TrimStage(2, 'frames', trimmed_dir, workers=2)
+    for path in audio_files:
+        stage.submit(path)
+    if len(stage.results(audio_files)) != len(audio_files):
+        raise SystemExit(1)
+
+
+@needs_ffmpeg
+def test_trim_stage_in_daemonic_process(tmp_path):
+    """A job worker (or any daemonic process) cannot start the trim pool, trims still happen"""
+    audio_files = [make_mp3(str(tmp_path / f'song_{i}.mp3'), 4, 300 + i * 100) for i in range(3)]
+    trimmed_dir = tmp_path / 'trimmed'
+    trimmed_dir.mkdir()
+    process = multiprocessing.get_context('spawn').Process(
+        target=_trim_in_daemon, args=(audio_files, str(trimmed_dir)), daemon=True)
+    process.start()
+    process.join(60)
+    assert process.exitcode == 0
+    assert sorted(os.listdir(trimmed_dir)) == [f'trimmed_song_{i}.mp3' for i in range(3)]
+
+
+def test_head_only_download_not_reused_for_longer_clip(tmp_path):
+    from audio_cache import DiskCache
+    from downloader import download_entry
+
+    class FakeYoutubeDL:
+        downloads = 0
+
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download=True):
+            FakeYoutubeDL.downloads += 1
+            path = self.opts['outtmpl'].replace('%(id)s', 'abc').replace('%(ext)s', 'mp3')
+            with open(path, 'wb') as f:
+                f.write(b'audio')
+            return {'requested_downloads': [{'filepath': path}]}
+
+    cache = DiskCache(str(tmp_path / 'cache'), 10 ** 6)
+    entry = {'id': 'abc', 'url': 'https://example.com/abc', 'title': 'abc'}
+    fetched = []
+
+    def download(job, head_seconds, clip_seconds):
+        # Every job downloads into its own directory
+        job_dir = tmp_path / job
+        job_dir.mkdir()
+        ydl_opts = {'outtmpl': str(job_dir / '%(id)s.%(ext)s'), 'format': 'bestaudio'}
+        download_entry(entry, ydl_opts, FakeYoutubeDL, cache, head_seconds, clip_seconds,
+                       on_fetch=fetched.append)
+
+    download('first', 20, 20)
+    download('same_clip', 20, 20)
+    assert FakeYoutubeDL.downloads == 1
+    # A longer clip, or a full download, needs more than the stored head
+    download('full', None, 60)
+    assert FakeYoutubeDL.downloads == 2
+    download('after_full', 40, 40)
+    assert FakeYoutubeDL.downloads == 2
+    # Only network downloads are reported (and counted as downloaded bytes)
+    assert [os.path.basename(os.path.dirname(path)) for path in fetched] == ['first', 'full']
+
+
+def test_trim_progress_overlapping_downloads(tmp_path):
+    from job_queue import JobQueue
+
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    job_id, _ = queue.enqueue('Singer', 2, 20, 'a@example.com')
+    queue.claim('test')
+    for stage, done, total in (('search', None, None), ('download', 1, 2), ('trim', 1, 2),
+                               ('download', 2, 2), ('trim', 2, 2), ('merge', None, None)):
+        queue.set_progress(job_id, stage, done, total)
+        if stage == 'trim' and done == 1:
+            # The first clip is trimmed while the second video still downloads
+            status = queue.status(job_id)
+            assert status['stage'] == 'trim'
+            assert [(s['name'], s['done'], s['finished']) for s in status['stages']] == [
+                ('search', None, True), ('download', 1, False), ('trim', 1, False)]
+    stages = queue.status(job_id)['stages']
+    assert [(s['name'], s['done'], s['finished']) for s in stages] == [
+        ('search', None, True), ('download', 2, True), ('trim', 2, True), ('merge', None, False)]
+
+
+@needs_ffmpeg
+def test_slice_mp3(tmp_path):
+    from mp3_slicer import slice_mp3
+
+    source = make_mp3(str(tmp_path / 'song.mp3'), 10)
+    sliced = str(tmp_path / 'sliced.mp3')
+    seconds = slice_mp3(source, sliced, 4)
+    # The frames written include the encoder delay the decoder drops
+    assert 4 <= seconds < 4.1
+    # Cut on a frame boundary (1152 samples, ~26 ms)
+    assert abs(mp3_seconds(sliced) - 4) < 0.03
+    assert os.path.getsize(sliced) < os.path.getsize(source) / 2
+
+
+def _merge_peak_rss_mb(input_files, output_file, clip_seconds, ram_budget_mb):
+    from audio_merge import pcm_merge
+
+    pcm_merge(input_files, output_file, clip_seconds, loudness=-18, crossfade_ms=500,
+              ram_budget_mb=ram_budget_mb)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@needs_ffmpeg
+def test_scratch_merge_stays_under_rss_ceiling(tmp_path):
+    """The PCM of the mashup (24 clips of 30s, ~120 MB) is larger than the ceiling"""
+    pytest.importorskip('numpy')
+    clip = make_mp3(str(tmp_path / 'clip.mp3'), 30)
+    input_files = [clip] * 24
+    output_file = str(tmp_path / 'mashup.mp3')
+    # A fresh process, so its peak RSS is the merge's alone
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        peak_mb = pool.submit(_merge_peak_rss_mb, input_files, output_file, 30, 0).result()
+    assert peak_mb < SCRATCH_RSS_CEILING_MB
+    assert abs(mp3_seconds(output_file) - 24 * 30) < 30
+    # The scratch file is removed after the merge
+    assert sorted(os.listdir(tmp_path)) == ['clip.mp3', 'mashup.mp3']
+
+
+def test_job_queue_coalesces_identical_requests(tmp_path):
+    from job_queue import JobQueue
+
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    job_id, coalesced = queue.enqueue('Sharry Maan', 10, 25, 'a@example.com')
+    assert not coalesced
+    # Case and spacing of the singer are ignored
+    same_id, coalesced = queue.enqueue('  sharry   MAAN ', 10, 25, 'b@example.com')
+    assert (same_id, coalesced) == (job_id, True)
+    assert queue.recipients(job_id) == ['a@example.com', 'b@example.com']
+    other_id, coalesced = queue.enqueue('Sharry Maan', 10, 30, 'c@example.com')
+    assert other_id != job_id and not coalesced
+
+    # Once the job is emailing its result a new request starts a new job
+    queue.claim('test')
+    queue.set_progress(job_id, 'email')
+    late_id, coalesced = queue.enqueue('Sharry Maan', 10, 25, 'd@example.com')
+    assert late_id != job_id and not coalesced
+    assert queue.stats()['coalesced'] == 1
+
+
+def test_job_queue_recovers_interrupted_jobs(tmp_path):
+    import job_queue
+
+    queue = job_queue.JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    job_id, _ = queue.enqueue('Singer', 5, 20, 'a@example.com')
+    assert queue.claim('worker-1')['id'] == job_id
+    # Heartbeats still arriving: nothing to recover
+    assert queue.recover(lease_seconds=60) == 0
+
+    for attempt in range(1, job_queue.JOB_MAX_ATTEMPTS):
+        # The worker died: its lease runs out and the job is queued again
+        assert queue.recover(lease_seconds=-1) == 1
+        assert queue.get(job_id)['status'] == 'queued'
+        job = queue.claim('worker-2')
+        # claim() returns the row as it was before this attempt
+        assert job['id'] == job_id and job['attempts'] == attempt
+
+    # Out of attempts: failed instead of requeued
+    assert queue.recover(lease_seconds=-1) == 0
+    job = queue.get(job_id)
+    assert job['status'] == 'failed' and job['attempts'] == job_queue.JOB_MAX_ATTEMPTS
+
+
+@needs_ffmpeg
+def test_scratch_merge_failure_keeps_error_and_removes_file(tmp_path, monkeypatch):
+    pytest.importorskip('numpy')
+    import audio_merge
+
+    def broken_energy(numpy, buffer, clips, release):
+        samples = buffer[:1024].astype(numpy.float32)
+        raise ValueError(f"energy failed after {len(samples)} frames")
+
+    monkeypatch.setattr(audio_merge, '_clip_energy', broken_energy)
+    clip = make_mp3(str(tmp_path / 'clip.mp3'), 2)
+    with pytest.raises(ValueError, match='energy failed'):
+        audio_merge.pcm_merge([clip] * 3, str(tmp_path / 'mashup.mp3'), 2, loudness=-18,
+                              ram_budget_mb=0)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.pcm')]
+
+
+@needs_ffmpeg
+def test_trim_stages_share_one_pool(tmp_path):
+    from trimming import TrimStage
+
+    audio_files = [make_mp3(str(tmp_path / f'song_{i}.mp3'), 4, 300 + i * 100) for i in range(2)]
+    pools = []
+    for job in range(2):
+        trimmed_dir = tmp_path / f'trimmed_{job}'
+        trimmed_dir.mkdir()
+        stage = TrimStage(2, 'frames', str(trimmed_dir), workers=2)
+        for path in audio_files:
+            stage.submit(path)
+        assert len(stage.results(audio_files)) == 2
+        pools.append(stage._pool)
+    # The second job reuses the processes the first one started
+    assert pools[0] is not None and pools[0] is pools[1]
+
+
+def test_outbox_batch_through_local_smtp_server(tmp_path, monkeypatch):
+    pytest.importorskip('aiosmtpd')
+    import email
+    import socket
+    import zipfile
+    import mailer
+    import metrics
+    from benchmark import start_smtp_server
+
+    monkeypatch.setattr(mailer, 'SMTP_STARTTLS', False)
+    monkeypatch.setattr(metrics, '_metrics', metrics.Metrics(str(tmp_path / 'metrics.sqlite3')))
+    zip_file = str(tmp_path / 'mashup.zip')
+    with zipfile.ZipFile(zip_file, 'w') as archive:
+        archive.writestr('mashup.mp3', os.urandom(300 * 1024))
+
+    received = []
+    controller, port = start_smtp_server(received=received)
+    try:
+        outbox = mailer.Outbox(str(tmp_path / 'mail.sqlite3'), str(tmp_path / 'outbox'))
+        connection = mailer.SMTPConnection('127.0.0.1', port)
+        outbox.add('job1', ['a@example.com', 'b@example.com'], zip_file=zip_file)
+        mailer.send_batch(outbox, connection, outbox.claim())
+        # The server dropped the connection: the next message reconnects
+        connection.smtp.sock.shutdown(socket.SHUT_RDWR)
+        outbox.add('job2', ['c@example.com'], link='https://example.com/results/job2')
+        mailer.send_batch(outbox, connection, outbox.claim())
+        connection.close()
+    finally:
+        controller.stop()
+
+    assert connection.connects == 2
+    assert outbox.stats()['sent'] == 3
+    # Spooled attachments are deleted once sent
+    assert os.listdir(tmp_path / 'outbox') == []
+    messages = [email.message_from_bytes(content) for content in received]
+    assert [message['To'] for message in messages] == ['a@example.com', 'b@example.com', 'c@example.com']
+    attachment = [part for part in messages[0].walk() if part.get_filename()][0]
+    with open(zip_file, 'rb') as f:
+        assert attachment.get_payload(decode=True) == f.read()
+    assert 'https://example.com/results/job2' in messages[2].get_payload(decode=True).decode()
+
+
+def test_outbox_add_is_idempotent_per_job(tmp_path):
+    import mailer
+
+    outbox = mailer.Outbox(str(tmp_path / 'mail.sqlite3'), str(tmp_path / 'outbox'))
+    zip_file = tmp_path / 'mashup.zip'
+    zip_file.write_bytes(b'zip')
+    assert outbox.add('job1', ['a@example.com', 'b@example.com'], zip_file=str(zip_file)) == 2
+    message = outbox.claim(limit=1)[0]
+    outbox.sent(message, 10)
+    # The job ran again after its worker died: only a new recipient gets a message
+    assert outbox.add('job1', ['a@example.com', 'b@example.com', 'c@example.com'],
+                      zip_file=str(zip_file)) == 1
+    assert outbox.job_deliveries('job1') == {'sent': 1, 'queued': 2}
+    assert outbox.add('job1', ['a@example.com'], zip_file=str(zip_file)) == 0
+    assert os.listdir(tmp_path / 'outbox') == ['job1.zip']
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize('engine', ['stream', 'numpy'])
+def test_merge_reports_clips_that_fail_to_decode(tmp_path, capsys, engine):
+    if engine == 'numpy':
+        pytest.importorskip('numpy')
+    from audio_merge import stream_merge, pcm_merge
+
+    def merge(input_files, output_file):
+        if engine == 'stream':
+            return stream_merge(input_files, output_file)
+        return pcm_merge(input_files, output_file, 3, ram_budget_mb=0)
+
+    good = make_mp3(str(tmp_path / 'good.mp3'), 3)
+    corrupt = tmp_path / 'corrupt.mp3'
+    corrupt.write_bytes(os.urandom(64 * 1024))
+    output_file = str(tmp_path / 'mashup.mp3')
+
+    seconds = merge([good, str(corrupt), good], output_file)
+    assert abs(seconds - 6) < 0.1
+    assert abs(mp3_seconds(output_file) - 6) < 0.2
+    assert 'corrupt.mp3' in capsys.readouterr().out
+
+    with pytest.raises(Exception, match='None of the clips'):
+        merge([str(corrupt)], output_file)
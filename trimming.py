@@ -0,0 +1,196 @@
+"""
+Mashup Assignment - Trimming
+Cuts the first seconds out of each downloaded audio, shared by the CLI and the web app
+"""
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pydub import AudioSegment
+from mp3_slicer import slice_mp3
+from audio_cache import trim_cache_key
+
+
+# Trim engine: 'pydub' (decode + re-encode) or 'frames' (copy MP3 frames)
+TRIM_ENGINE = os.environ.get('TRIM_ENGINE', 'pydub')
+
+# Trim each file as soon as its download lands instead of after all downloads
+OVERLAP_STAGES = os.environ.get('OVERLAP_STAGES', '1') == '1'
+
+
+def available_cpus():
+    """CPUs this process may run on (a container's cpuset rather than the host's CPU count)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Trims running at the same time, each in its own process (1 trims in the calling process).
+# By default the CPUs are shared out between the JOB_WORKERS job processes
+TRIM_WORKERS = int(os.environ.get('TRIM_WORKERS')
+                   or max(1, available_cpus() // int(os.environ.get('JOB_WORKERS', '2'))))
+
+# Downloaded files waiting for a trim worker before the downloader has to wait
+TRIM_QUEUE_SIZE = int(os.environ.get('TRIM_QUEUE_SIZE', '4'))
+
+
+# Process pool shared by every TrimStage of this process (see get_trim_pool)
+_trim_pool = None
+_trim_pool_workers = None
+_trim_pool_lock = threading.Lock()
+
+
+def get_trim_pool(workers):
+    """
+    The trim process pool of this process, started on first use and reused by
+    later jobs (a pool of a different size replaces it). None in a daemonic
+    process, which may not start children.
+    """
+    global _trim_pool, _trim_pool_workers
+    if multiprocessing.current_process().daemon:
+        return None
+    with _trim_pool_lock:
+        if _trim_pool and _trim_pool_workers != workers:
+            _trim_pool.shutdown(wait=False)
+            _trim_pool = None
+        if _trim_pool is None:
+            _trim_pool = ProcessPoolExecutor(max_workers=workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+            _trim_pool_workers = workers
+        return _trim_pool
+
+
+def _discard_trim_pool(pool):
+    """Stop using a pool that cannot run trims, the next get_trim_pool() starts a new one"""
+    global _trim_pool
+    with _trim_pool_lock:
+        if _trim_pool is pool:
+            _trim_pool = None
+    pool.shutdown(wait=False)
+
+
+def trim_file(audio_path, trimmed_path, duration, engine=None):
+    """Write the first `duration` seconds of audio_path to trimmed_path"""
+    if (engine or TRIM_ENGINE) == 'frames':
+        # Copy whole MP3 frames, no decode or re-encode
+        slice_mp3(audio_path, trimmed_path, duration)
+    else:
+        audio = AudioSegment.from_mp3(audio_path)
+        audio[:duration * 1000].export(trimmed_path, format='mp3')
+
+
+def _trim_in_child(audio_path, trimmed_path, duration, engine, converter):
+    """trim_file in a pool process (which does not inherit pydub's ffmpeg setting)"""
+    AudioSegment.converter = converter
+    trim_file(audio_path, trimmed_path, duration, engine)
+
+
+def trim_cached(audio_path, duration, engine=None, trimmed_dir='trimmed', cache=None, pool=None):
+    """
+    Trim audio_path into trimmed_dir/trimmed_<name>, reusing a clip trimmed by
+    an earlier job when the cache has one. The trim itself runs on pool (a
+    process pool) if given. Returns (trimmed_path, reused).
+    """
+    engine = engine or TRIM_ENGINE
+    trimmed_name = f"trimmed_{os.path.basename(audio_path)}"
+    trimmed_path = os.path.join(trimmed_dir, trimmed_name)
+
+    # Same video, duration and settings as an earlier job
+    key = trim_cache_key(audio_path, duration, engine) if cache else None
+    if key and cache.get(key, trimmed_dir, dest_name=trimmed_name):
+        return trimmed_path, True
+
+    start = time.perf_counter()
+    future = None
+    if pool:
+        try:
+            future = pool.submit(_trim_in_child, audio_path, trimmed_path, duration, engine,
+                                 AudioSegment.converter)
+        except Exception as e:
+            # The pool could not start its processes, or is broken or shut down
+            print(f"  ⚠ Trim pool unavailable ({type(e).__name__}: {e}), trimming in-process")
+            _discard_trim_pool(pool)
+    try:
+        if not future:
+            raise BrokenProcessPool
+        future.result()
+    except BrokenProcessPool:
+        # No pool, or its processes died: trim in this process instead
+        if future:
+            _discard_trim_pool(pool)
+        trim_file(audio_path, trimmed_path, duration, engine)
+    if key:
+        cache.put(key, trimmed_path, cost=time.perf_counter() - start)
+    return trimmed_path, False
+
+
+class TrimStage:
+    """
+    Trims files on TRIM_WORKERS processes, as they are submitted.
+
+    submit() hands a file (e.g. a download that just landed) to the trim
+    threads through a queue of TRIM_QUEUE_SIZE files; it blocks when the
+    queue is full, so a fast producer waits instead of piling up work. Each
+    thread checks the trim cache and runs the trim on a process pool, so
+    several cores decode/encode at once. finish() waits for the trims,
+    results() returns the trimmed paths in the order of the files given
+    (files that failed to trim are left out, like trim_audio always did).
+    on_trim(audio_path, trimmed_path, reused, error) is called per file.
+    """
+
+    def __init__(self, duration, engine=None, trimmed_dir='trimmed', cache=None, workers=None,
+                 queue_size=None, on_trim=None):
+        self.duration = duration
+        self.engine = engine or TRIM_ENGINE
+        self.trimmed_dir = trimmed_dir
+        self.cache = cache
+        self.on_trim = on_trim
+        self.trimmed = {}
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size or TRIM_QUEUE_SIZE)
+        workers = max(1, workers or TRIM_WORKERS)
+        # Shared with the other stages (jobs) of this process, finish() leaves it running
+        self._pool = get_trim_pool(workers) if workers > 1 else None
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            audio_path = self._queue.get()
+            if audio_path is None:
+                return
+            trimmed_path, reused, error = None, False, None
+            try:
+                trimmed_path, reused = trim_cached(audio_path, self.duration, self.engine,
+                                                   self.trimmed_dir, self.cache, self._pool)
+            except Exception as e:
+                error = e
+            with self._lock:
+                if trimmed_path:
+                    self.trimmed[audio_path] = trimmed_path
+                    self.reused += reused
+                if self.on_trim:
+                    self.on_trim(audio_path, trimmed_path, reused, error)
+
+    def submit(self, audio_path):
+        self._queue.put(audio_path)
+
+    def finish(self):
+        """Wait for every submitted file (safe to call twice)"""
+        if not self._threads:
+            return
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def results(self, audio_files):
+        self.finish()
+        return [self.trimmed[path] for path in audio_files if path in self.trimmed]
@@ -0,0 +1,134 @@
+"""
+Mashup Assignment - Job Worker
+Runs queued mashup jobs on a fixed pool of worker processes
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import importlib
+import threading
+import multiprocessing
+from job_queue import JobQueue, JOB_LEASE_SECONDS
+from audio_merge import probe_ffmpeg
+from mailer import delivery_loop
+from metrics import get_metrics, StageTimer
+
+
+# Number of mashup jobs processed at the same time
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+
+# Seconds an idle worker waits before checking the queue again
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+
+
+def run_job(queue, job):
+    """Run one job, keeping its lease alive, and record the outcome"""
+    # Imported here so the supervisor process never loads the pipeline
+    from pipeline import process_mashup
+
+    stop = threading.Event()
+    timer = StageTimer(get_metrics())
+
+    def send_heartbeats():
+        while not stop.wait(JOB_LEASE_SECONDS / 4):
+            queue.heartbeat(job['id'])
+
+    def progress(stage, done=None, total=None):
+        timer.progress(stage, time.time(), done, total)
+        queue.set_progress(job['id'], stage, done, total)
+
+    threading.Thread(target=send_heartbeats, daemon=True).start()
+    try:
+        process_mashup(job['singer_name'], job['num_videos'], job['duration'], job['email'],
+                       progress=progress, get_recipients=lambda: queue.recipients(job['id']),
+                       job_id=job['id'])
+        queue.complete(job['id'])
+        timer.finish('done', time.time())
+    except Exception as e:
+        queue.fail(job['id'], e)
+        timer.finish('failed', time.time())
+    finally:
+        stop.set()
+
+
+def worker_loop(number):
+    """Claim and run jobs forever (one process of the pool)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Load yt-dlp, pydub etc. while idle rather than at the start of the first job
+    importlib.import_module('pipeline')
+    queue = JobQueue()
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        job = queue.claim(name)
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        print(f"🛠️  Worker {number} started job {job['id']} (attempt {job['attempts'] + 1})")
+        run_job(queue, job)
+
+
+def delivery_process():
+    """Send queued emails (the delivery process of the pool)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    delivery_loop()
+
+
+def main():
+    """
+    Start the worker pool and the email delivery process, restart them when
+    they crash and requeue interrupted jobs.
+    """
+    print(f"🛠️  Starting {JOB_WORKERS} mashup workers")
+    # Probed once here, every worker process inherits the result
+    probe_ffmpeg()
+    queue = JobQueue()
+    context = multiprocessing.get_context('spawn')
+    workers = {}
+    delivery = None
+    running = True
+
+    def stop(signum, frame):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while running:
+        requeued = queue.recover()
+        if requeued:
+            print(f"♻️  Requeued {requeued} interrupted jobs")
+
+        for number in range(JOB_WORKERS):
+            process = workers.get(number)
+            if process is None or not process.is_alive():
+                if process is not None:
+                    print(f"⚠️  Worker {number} exited ({process.exitcode}), restarting")
+                # Not daemonic: the trim stage starts its own process pool in the worker
+                process = context.Process(target=worker_loop, args=(number,))
+                process.start()
+                workers[number] = process
+
+        # Emails are sent by their own process so a slow SMTP server never holds a worker
+        if delivery is None or not delivery.is_alive():
+            if delivery is not None:
+                print(f"⚠️  Email delivery exited ({delivery.exitcode}), restarting")
+            delivery = context.Process(target=delivery_process, daemon=True)
+            delivery.start()
+
+        time.sleep(JOB_POLL_INTERVAL * 5)
+
+    print("🛑 Stopping mashup workers")
+    processes = list(workers.values()) + ([delivery] if delivery else [])
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout=10)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
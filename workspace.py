@@ -0,0 +1,44 @@
+"""
+Mashup Assignment - Job Workspaces
+Private scratch directories so several mashup jobs can run side by side
+"""
+
+import os
+import shutil
+import tempfile
+
+
+# Parent directory for job workspaces (e.g. a tmpfs mount), system temp dir if unset
+WORKSPACE_ROOT = os.environ.get('WORKSPACE_ROOT') or None
+
+
+class Workspace:
+    """
+    A job's own downloads/, audios/, trimmed/ and output/ directories.
+
+    Created under WORKSPACE_ROOT with a unique name and removed by cleanup()
+    (or when used as a context manager), whatever happened in the job.
+    """
+
+    SUBDIRECTORIES = ('downloads', 'audios', 'trimmed', 'output')
+
+    def __init__(self, root=None, prefix='mashup_'):
+        root = root or WORKSPACE_ROOT
+        if root:
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+        for name in self.SUBDIRECTORIES:
+            directory = os.path.join(self.path, name)
+            os.makedirs(directory)
+            setattr(self, name, directory)
+
+    def cleanup(self):
+        """Remove the workspace and everything in it (safe to call twice)"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+        return False